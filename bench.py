@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import draw
+from draw import Lyr, scan_fill
+def point_fill(lyr, x, y, new_c, new_col, new_bg):
+    old_c = lyr.get(x, y)
+    old_col = lyr.get_col(x, y)
+    if old_c == new_c and old_col == new_col:
+        return
+    stack = [(x, y)]
+    while stack:
+        cx, cy = stack.pop()
+        if lyr.get(cx, cy) != old_c or lyr.get_col(cx, cy) != old_col:
+            continue
+        lyr.set(cx, cy, new_c, new_col, new_bg)
+        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            nx, ny = cx + dx, cy + dy
+            if 0 <= nx < lyr.w and 0 <= ny < lyr.h:
+                if lyr.get(nx, ny) == old_c and lyr.get_col(nx, ny) == old_col:
+                    stack.append((nx, ny))
+def span_fill(lyr, x, y, new_c, new_col, new_bg):
+    scan_fill(lyr, x, y, (0, 0, lyr.w - 1, lyr.h - 1), new_c, new_col, new_bg)
+def empty(lyr):
+    pass
+def comb(lyr, w=None, h=None):
+    w = lyr.w if w is None else w
+    h = lyr.h if h is None else h
+    for x in range(1, w - 1, 4):
+        if x % 8 == 1:
+            lyr.fill_rect(x, 0, x, h - 2, '#', 1, 0)
+        else:
+            lyr.fill_rect(x, 1, x, h - 1, '#', 1, 0)
+def bench_fill(n=1000):
+    for nm, setup in [("empty", empty), ("comb", comb)]:
+        times = {}
+        for algo, fn in [("point", point_fill), ("span", span_fill)]:
+            lyr = Lyr(n, n)
+            setup(lyr)
+            t0 = time.perf_counter()
+            fn(lyr, 0, 0, '*', 2, 0)
+            times[algo] = time.perf_counter() - t0
+        print(f"fill {nm} {n}x{n}: point {times['point']:.3f}s span {times['span']:.3f}s "
+              f"speedup {times['point'] / times['span']:.1f}x")
+def bench_engines(n=1000):
+    engs = [draw.PyEng()]
+    if draw.np is not None:
+        engs.append(draw.NpEng())
+    rnd = random.Random(1)
+    src = Lyr(n, n)
+    for _ in range(n * 20):
+        src.set(rnd.randrange(n), rnd.randrange(n), '#', 2, 0)
+    for eng in engs:
+        draw.ENG = eng
+        dst = Lyr(n, n)
+        t0 = time.perf_counter()
+        for y in range(n):
+            dst.put_span(0, y, *src.get_span(0, n - 1, y), skip=True)
+        t1 = time.perf_counter()
+        dst.fill_rect(0, 0, n - 1, n - 1, '*', 1, 0)
+        t2 = time.perf_counter()
+        dst.clr()
+        t3 = time.perf_counter()
+        print(f"engine {eng.nm} {n}x{n}: paste {t1 - t0:.3f}s fill {t2 - t1:.4f}s clr {t3 - t2:.4f}s")
+def point_circ(app, cx, cy, r):
+    for y in range(cy - r, cy + r + 1):
+        for x in range(cx - r, cx + r + 1):
+            if (x - cx)**2 + (y - cy)**2 <= r**2:
+                app.draw_pt(x, y)
+def bench_shapes(n=1000):
+    r = max(8, n // 10)
+    app = draw.headless(80, 24)
+    t0 = time.perf_counter()
+    point_circ(app, 0, 0, r)
+    t1 = time.perf_counter()
+    draw.GEOM.clear()
+    app.draw_circ(0, 0, r, True)
+    t2 = time.perf_counter()
+    print(f"circ.fill r={r}: point {t1 - t0:.4f}s span {t2 - t1:.4f}s speedup {(t1 - t0) / (t2 - t1):.1f}x")
+    for nm in ["star", "tri", "hex", "dia", "heart"]:
+        ts = []
+        draw.GEOM.clear()
+        for fill in [False, True, True]:
+            t0 = time.perf_counter()
+            app.draw_poly(nm, 0, 0, r, fill)
+            ts.append(time.perf_counter() - t0)
+        print(f"{nm} r={r}: outline {ts[0]:.4f}s fill {ts[1]:.4f}s fill cached {ts[2]:.4f}s")
+    app.autosave.stop()
+def pct(ts, p):
+    ts = sorted(ts)
+    return ts[min(len(ts) - 1, int(p / 100 * len(ts)))]
+def measure(fn, n, setup=None):
+    ts = []
+    for _ in range(n):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        ts.append(time.perf_counter() - t0)
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    tot = sum(ts)
+    return {
+        "n": n,
+        "ops_per_sec": n / tot if tot else 0.0,
+        "mean_ms": tot / n * 1000,
+        "p50_ms": pct(ts, 50) * 1000,
+        "p90_ms": pct(ts, 90) * 1000,
+        "p99_ms": pct(ts, 99) * 1000,
+        "peak_kb": peak / 1024,
+    }
+def scene(app, nl, seed=1):
+    rnd = random.Random(seed)
+    for i in range(nl - 1):
+        app.add_lyr()
+    for i in range(len(app.lyrs)):
+        app.lyr = i
+        for _ in range(20):
+            app.col = rnd.randrange(1, 8)
+            x1, y1 = rnd.randrange(app.cw), rnd.randrange(app.ch)
+            x2, y2 = rnd.randrange(app.cw), rnd.randrange(app.ch)
+            if rnd.random() < 0.5:
+                app.draw_line(x1, y1, x2, y2)
+            else:
+                app.draw_rect(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2), rnd.random() < 0.3)
+    app.lyr = 0
+    app.save_state()
+    app.render()
+def suite(quick=False):
+    k = 1 if quick else 4
+    res = {}
+    apps = []
+    def mk(w=80, h=24, nl=1):
+        app = draw.headless(w, h)
+        apps.append(app)
+        scene(app, nl)
+        return app
+    for w, h in [(80, 24), (160, 48), (320, 96)]:
+        for nl in [1, 4]:
+            app = mk(w, h, nl)
+            def full(app=app):
+                app.recomp = True
+                app.render()
+            res[f"render.full.{w}x{h}.l{nl}"] = measure(full, 5 * k)
+            def stroke(app=app):
+                app.draw_line(1, 1, app.cw - 2, app.ch - 2)
+                app.render()
+            res[f"render.stroke.{w}x{h}.l{nl}"] = measure(stroke, 10 * k)
+            res[f"render.idle.{w}x{h}.l{nl}"] = measure(app.render, 50 * k)
+    app = mk(320, 96)
+    def fresh(fn):
+        def setup():
+            app.lyrs[0] = app.new_lyr("main")
+            app.lyr = 0
+            fn(app.lyrs[0], app.cw, app.ch)
+        return setup
+    res["fill.empty"] = measure(lambda: app.flood_fill(0, 0, '*', 2, 0), 5 * k, fresh(lambda lyr, w, h: None))
+    res["fill.comb"] = measure(lambda: app.flood_fill(0, 0, '*', 2, 0), 3 * k, fresh(comb))
+    app = mk()
+    shapes = {
+        "line": lambda: app.draw_line(2, 3, 70, 17),
+        "rect": lambda: app.draw_rect(2, 2, 60, 18),
+        "rect.fill": lambda: app.draw_rect(2, 2, 60, 18, True),
+        "circ": lambda: app.draw_circ(40, 10, 8),
+        "circ.fill": lambda: app.draw_circ(40, 10, 8, True),
+        "arrow": lambda: app.draw_arrow(5, 5, 60, 15),
+        "star": lambda: app.draw_star(40, 10, 8),
+        "triangle": lambda: app.draw_triangle(40, 10, 8),
+        "hex": lambda: app.draw_hex(40, 10, 8),
+        "diamond": lambda: app.draw_diamond(40, 10, 8),
+        "heart": lambda: app.draw_heart(40, 10, 8),
+        "star.fill": lambda: app.draw_star(40, 10, 8, True),
+        "triangle.fill": lambda: app.draw_triangle(40, 10, 8, True),
+        "hex.fill": lambda: app.draw_hex(40, 10, 8, True),
+        "diamond.fill": lambda: app.draw_diamond(40, 10, 8, True),
+        "heart.fill": lambda: app.draw_heart(40, 10, 8, True),
+    }
+    for nm, fn in shapes.items():
+        res[f"shape.{nm}"] = measure(fn, 50 * k)
+    big = {
+        "circ": lambda: app.draw_circ(40, 10, 100),
+        "circ.fill": lambda: app.draw_circ(40, 10, 100, True),
+        "star.fill": lambda: app.draw_star(40, 10, 100, True),
+        "heart.fill": lambda: app.draw_heart(40, 10, 100, True),
+    }
+    for nm, fn in big.items():
+        res[f"shape.{nm}.r100"] = measure(fn, 5 * k)
+    lyr = app.get_lyr()
+    for pat in app.pats:
+        res[f"pat.{pat.nm}"] = measure(lambda: pat.apply(lyr, 40, 10, 2, 0), 100 * k)
+    app.hist.clear()
+    def edit():
+        app.draw_rect(5, 5, 50, 15, True)
+    res["hist.save_state"] = measure(app.save_state, 50 * k, edit)
+    res["hist.undo"] = measure(app.undo, 25 * k, lambda: (edit(), app.save_state()))
+    app = mk(320, 96, 4)
+    with tempfile.TemporaryDirectory() as d:
+        for ext in ["dtb", "json"]:
+            fname = os.path.join(d, "bench." + ext)
+            res[f"io.save.{ext}"] = measure(lambda: app.save_file(fname), 3 * k)
+            res[f"io.load.{ext}"] = measure(lambda: app.load_file(fname), 3 * k)
+    for app in apps:
+        app.autosave.stop()
+    return res
+def check_help_replay():
+    with tempfile.TemporaryDirectory() as d:
+        fname = os.path.join(d, "help.journal")
+        scr = draw.HScr(80, 24, [ord(c) for c in "h3+h76 q"])
+        app = draw.App(scr, draw.HTerm(scr), journal=fname, seed=1)
+        try:
+            app.run()
+        finally:
+            app.autosave.stop()
+            app.jrn.close()
+        rep, res = draw.replay(fname)
+    st = lambda a: (a.tool, a.br, a.lyr, len(a.lyrs))
+    return st(app) == st(rep) and not rep.scr.keys
+def check_readme_headless():
+    app = draw.headless(80, 24, [ord(c) for c in ' ddd q'])
+    app.run()
+    app.autosave.stop()
+    rows = app.scr.text().splitlines()
+    lyr = app.get_lyr()
+    cells = [(x, y) for y in range(app.ch) for x in range(app.cw) if lyr.get(x, y) != ' ']
+    return len(cells) == 2 and all(rows[y + 1][x] == lyr.get(x, y) for x, y in cells)
+def checks():
+    return {
+        "replay.help": check_help_replay(),
+        "headless.readme": check_readme_headless(),
+    }
+def compare(res, base, thr):
+    regs = []
+    for nm, r in res.items():
+        b = base.get(nm)
+        if not b or not b["ops_per_sec"]:
+            continue
+        ratio = r["ops_per_sec"] / b["ops_per_sec"]
+        r["vs_base"] = ratio
+        if ratio < 1 - thr:
+            regs.append(nm)
+    return regs
+def main(argv):
+    ap = argparse.ArgumentParser(description="whiteboard benchmarks")
+    ap.add_argument("--quick", action="store_true", help="fewer iterations")
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--baseline", help="results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.2, help="allowed ops/sec drop (0.2 = 20%%)")
+    ap.add_argument("--legacy", type=int, metavar="N", help="run the point-vs-span fill and engine comparisons at NxN")
+    ap.add_argument("--check", action="store_true", help="run the headless and replay determinism checks")
+    args = ap.parse_args(argv)
+    if args.check:
+        res = checks()
+        print(json.dumps(res, indent=2))
+        return 0 if all(res.values()) else 1
+    if args.legacy:
+        bench_fill(args.legacy)
+        bench_engines(args.legacy)
+        bench_shapes(args.legacy)
+        return 0
+    random.seed(1)
+    doc = {
+        "meta": {
+            "python": platform.python_version(),
+            "engine": draw.ENG.nm,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": suite(args.quick),
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            base = json.load(f)["results"]
+        doc["regressions"] = compare(doc["results"], base, args.threshold)
+    out = json.dumps(doc, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    return 1 if doc.get("regressions") else 0
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
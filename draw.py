@@ -5,10 +5,158 @@ import time
 import json
 import os
 import random
+import re
+import mmap
+import struct
+import sys
+import threading
+import queue
+import tempfile
+import select
+from array import array
 from collections import defaultdict, deque
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = tty = None
 W, H = 80, 24  
 DEBUG = os.environ.get('WHITEBOARD_DEBUG', 'false').lower() == 'true'
-TOOLS = ["pen", "ers", "line", "box", "circ", "fill", "spray", "text", "sel", "move", "copy", "pat", "arrow", "star", "tri", "hex"]
+AUTOSAVE_SECS = float(os.environ.get('WHITEBOARD_AUTOSAVE', '30'))
+AUTOSAVE_EDITS = int(os.environ.get('WHITEBOARD_AUTOSAVE_EDITS', '50'))
+MAX_FPS = float(os.environ.get('WHITEBOARD_FPS', '60'))
+JOURNAL = os.environ.get('WHITEBOARD_JOURNAL', '')
+JOURNAL_MAX = int(os.environ.get('WHITEBOARD_JOURNAL_MAX', str(8 << 20)))
+PATTERNS = os.environ.get('WHITEBOARD_PATTERNS', 'patterns.txt')
+TOOLS = ["pen", "ers", "line", "box", "circ", "fill", "spray", "text", "sel", "move", "copy", "pat", "arrow", "star", "tri", "hex", "dia", "heart"]
+SHAPE_TOOL = {"line": "line", "box": "box", "circle": "circ", "arrow": "arrow", "star": "star",
+              "triangle": "tri", "diamond": "dia", "heart": "heart"}
+SHAPE_TOOLS = ["line", "box", "circ", "arrow", "star", "tri", "hex", "dia", "heart"]
+RASTER_TOOLS = ["pen", "ers", "fill", "spray", "text", "pat"]
+INPUT_MAX = 256
+INPUT_MS = 8
+BTN = curses.BUTTON1_PRESSED | curses.BUTTON1_RELEASED | curses.BUTTON1_CLICKED
+MOVES = {
+    curses.KEY_UP: (0, -1), ord('w'): (0, -1),
+    curses.KEY_DOWN: (0, 1), ord('s'): (0, 1),
+    curses.KEY_LEFT: (-1, 0), ord('a'): (-1, 0),
+    curses.KEY_RIGHT: (1, 0), ord('d'): (1, 0),
+}
+BAYER = [0, 8, 2, 10, 12, 4, 14, 6, 3, 11, 1, 9, 15, 7, 13, 5]
+class PyEng:
+    nm = "python"
+    def put_skip(self, lyr, i, chs, fgs, bgs):
+        s = None
+        n = len(chs)
+        for k in range(n + 1):
+            if k < n and chs[k] != 32:
+                if s is None:
+                    s = k
+            elif s is not None:
+                lyr.chs[i + s:i + k] = chs[s:k]
+                lyr.fgs[i + s:i + k] = fgs[s:k]
+                lyr.bgs[i + s:i + k] = bgs[s:k]
+                s = None
+    def fill(self, lyr, x1, y1, x2, y2, c, col, bg):
+        n = x2 - x1 + 1
+        cs = array('I', [ord(c)]) * n
+        fs = bytes([col]) * n if col is not None else None
+        bs = bytes([bg]) * n if bg is not None else None
+        for y in range(y1, y2 + 1):
+            i = y * lyr.w + x1
+            lyr.chs[i:i + n] = cs
+            if fs is not None:
+                lyr.fgs[i:i + n] = fs
+            if bs is not None:
+                lyr.bgs[i:i + n] = bs
+    def clear(self, lyr):
+        n = lyr.w * lyr.h
+        lyr.chs[:] = array('I', [32]) * n
+        lyr.fgs[:] = bytes(n)
+        lyr.bgs[:] = bytes(n)
+    def dither(self, chs, x0, y, alpha):
+        t = alpha * 16
+        row = BAYER[(y % 4) * 4:(y % 4) * 4 + 4]
+        out = array('I', chs)
+        for k in range(len(out)):
+            if row[(x0 + k) % 4] >= t:
+                out[k] = 32
+        return out
+    def compose(self, app):
+        return False
+class NpEng(PyEng):
+    nm = "numpy"
+    def __init__(self):
+        self.bayer = np.array(BAYER, dtype=np.float64).reshape(4, 4)
+    def planes(self, lyr):
+        return np.frombuffer(lyr.chs, np.uint32), np.frombuffer(lyr.fgs, np.uint8), np.frombuffer(lyr.bgs, np.uint8)
+    def put_skip(self, lyr, i, chs, fgs, bgs):
+        n = len(chs)
+        if n < 32:
+            return PyEng.put_skip(self, lyr, i, chs, fgs, bgs)
+        c, f, b = self.planes(lyr)
+        sc = np.frombuffer(chs, np.uint32)
+        m = sc != 32
+        c[i:i + n][m] = sc[m]
+        f[i:i + n][m] = np.frombuffer(fgs, np.uint8)[m]
+        b[i:i + n][m] = np.frombuffer(bgs, np.uint8)[m]
+    def fill(self, lyr, x1, y1, x2, y2, c, col, bg):
+        if (x2 - x1 + 1) * (y2 - y1 + 1) < 32:
+            return PyEng.fill(self, lyr, x1, y1, x2, y2, c, col, bg)
+        cp, fp, bp = self.planes(lyr)
+        cp.reshape(lyr.h, lyr.w)[y1:y2 + 1, x1:x2 + 1] = ord(c)
+        if col is not None:
+            fp.reshape(lyr.h, lyr.w)[y1:y2 + 1, x1:x2 + 1] = col
+        if bg is not None:
+            bp.reshape(lyr.h, lyr.w)[y1:y2 + 1, x1:x2 + 1] = bg
+    def clear(self, lyr):
+        c, f, b = self.planes(lyr)
+        c[:] = 32
+        f[:] = 0
+        b[:] = 0
+    def mask(self, x1, y1, x2, y2, alpha):
+        return self.bayer[np.ix_(np.arange(y1, y2) % 4, np.arange(x1, x2) % 4)] < alpha * 16
+    def dither(self, chs, x0, y, alpha):
+        out = np.frombuffer(chs, np.uint32).copy()
+        out[~self.mask(x0, y, x0 + len(out), y + 1, alpha)[0]] = 32
+        return array('I', out.tobytes())
+    def compose(self, app):
+        if app.zoom != 1.0 or any(not isinstance(lyr, TLyr) for lyr in app.lyrs):
+            return False
+        comp = app.comp
+        w, h = comp.w, comp.h
+        cc, cf, cb = [p.reshape(h, w) for p in self.planes(comp)]
+        cc[:] = 32
+        cf[:] = 0
+        cb[:] = 0
+        vx, vy = app.view_x, app.view_y
+        for lyr in app.lyrs:
+            if not lyr.vis:
+                continue
+            for ty in range(vy // TH, (vy + h - 1) // TH + 1):
+                for tx in range(vx // TW, (vx + w - 1) // TW + 1):
+                    t = lyr.tiles.get((tx, ty))
+                    if t is None or not t.ink():
+                        continue
+                    ox, oy = tx * TW, ty * TH
+                    x1, x2 = max(ox, vx), min(ox + TW, vx + w)
+                    y1, y2 = max(oy, vy), min(oy + TH, vy + h)
+                    tc, tf, tb = [p.reshape(TH, TW)[y1 - oy:y2 - oy, x1 - ox:x2 - ox] for p in self.planes(t)]
+                    m = tc != 32
+                    if lyr.alpha < 1.0:
+                        m &= self.mask(x1, y1, x2, y2, lyr.alpha)
+                    if not m.any():
+                        continue
+                    sl = (slice(y1 - vy, y2 - vy), slice(x1 - vx, x2 - vx))
+                    cc[sl][m] = tc[m]
+                    cf[sl][m] = tf[m]
+                    cb[sl][m] = tb[m]
+        return True
+ENG = NpEng() if np is not None and os.environ.get('WHITEBOARD_NUMPY', 'true').lower() != 'false' else PyEng()
 def toggle_debug():
     global DEBUG
     DEBUG = not DEBUG
@@ -16,65 +164,1089 @@ class Pt:
     def __init__(self, x, y):
         self.x = x
         self.y = y
+class Dmg:
+    def __init__(self):
+        self.rows = {}
+    def add(self, x, y):
+        s = self.rows.get(y)
+        if s is None:
+            self.rows[y] = [x, x]
+        elif x < s[0]:
+            s[0] = x
+        elif x > s[1]:
+            s[1] = x
+    def add_span(self, x1, x2, y):
+        s = self.rows.get(y)
+        if s is None:
+            self.rows[y] = [x1, x2]
+        else:
+            if x1 < s[0]:
+                s[0] = x1
+            if x2 > s[1]:
+                s[1] = x2
+    def add_rect(self, x1, y1, x2, y2):
+        for y in range(y1, y2 + 1):
+            self.add_span(x1, x2, y)
+    def clear(self):
+        self.rows.clear()
+    def __bool__(self):
+        return bool(self.rows)
+class Hist:
+    def __init__(self, n=50):
+        self.undo = deque(maxlen=n)
+        self.redo = deque(maxlen=n)
+        self.touched = []
+        self.ops = []
+        self.depth = 0
+    def begin(self):
+        self.depth += 1
+    def end(self):
+        if self.depth > 0:
+            self.depth -= 1
+        return self.commit()
+    def commit(self):
+        if self.depth:
+            return False
+        ops = self.ops
+        self.ops = []
+        for lyr in self.touched:
+            op = lyr.take_log()
+            if op:
+                ops.append(op)
+            lyr.prune()
+        self.touched = []
+        if not ops:
+            return False
+        self.undo.append(ops)
+        self.redo.clear()
+        return True
+    def clear(self):
+        for lyr in self.touched:
+            lyr.log = None
+            lyr.base = None
+        self.touched = []
+        self.ops = []
+        self.depth = 0
+        self.undo.clear()
+        self.redo.clear()
 class Lyr:
     def __init__(self, w, h, nm="layer"):
         self.w = w
         self.h = h
         self.nm = nm
-        self.d = [[' ' for _ in range(w)] for _ in range(h)]
-        self.cols = [[0 for _ in range(w)] for _ in range(h)]  
-        self.bg_cols = [[0 for _ in range(w)] for _ in range(h)]  
+        self.chs = array('I', [32]) * (w * h)
+        self.fgs = bytearray(w * h)
+        self.bgs = bytearray(w * h)
         self.vis = True
         self.lock = False
         self.alpha = 1.0  
+        self.dmg = None
+        self.hist = None
+        self.log = None
+        self.base = None
+        self.cow = False
+        self.occ = array('I', [0]) * h
+        self.lo = array('i', [0]) * h
+        self.hi = array('i', [0]) * h
+        self.used = bytearray(h)
+        self.dirty = set()
+        self.edge = set()
+        self.box = None
+        self.box_ok = True
+        self.home = None
     def get(self, x, y):
         if 0 <= x < self.w and 0 <= y < self.h:
-            return self.d[y][x]
+            return chr(self.chs[y * self.w + x])
         return ' '
     def get_col(self, x, y):
         if x >= 0 and x < self.w and y >= 0 and y < self.h:
-            return self.cols[y][x]
+            return self.fgs[y * self.w + x]
         else:
             return 0
     def get_bg(self, x, y):
         if x >= 0 and x < self.w:
             if y >= 0 and y < self.h:
-                return self.bg_cols[y][x] 
+                return self.bgs[y * self.w + x]
         return 0
     def set(self, x, y, c, col=None, bg=None):
         if x < 0 or x >= self.w or y < 0 or y >= self.h:
             return
         if self.lock:
             return  
-        self.d[y][x] = c
+        i = y * self.w + x
+        if self.cow:
+            self.own()
+        if self.hist is not None and self.base is None:
+            lg = self.log
+            if lg is None:
+                lg = self.open_log()
+            if i not in lg:
+                lg[i] = (self.chs[i], self.fgs[i], self.bgs[i])
+        self.chs[i] = ord(c)
         if col is not None:
-            self.cols[y][x] = col
+            self.fgs[i] = col
         if bg is not None:
-            self.bg_cols[y][x] = bg
+            self.bgs[i] = bg
+        self.dirty.add(y)
+        if self.dmg is not None:
+            self.dmg.add(x, y)
     def clr(self):
-        for y in range(self.h):
-            for x in range(self.w):
-                self.d[y][x] = ' '
-                self.cols[y][x] = 0
-                self.bg_cols[y][x] = 0
+        if not self.dirty and not any(self.used):
+            return
+        n = self.w * self.h
+        self.note_all()
+        if self.cow:
+            self.chs = array('I', [32]) * n
+            self.fgs = bytearray(n)
+            self.bgs = bytearray(n)
+            self.cow = False
+        else:
+            ENG.clear(self)
+        if self.dmg is not None:
+            self.dmg.add_rect(0, 0, self.w - 1, self.h - 1)
+        self.occ = array('I', [0]) * self.h
+        self.used = bytearray(self.h)
+        self.dirty.clear()
+        self.edge.clear()
+        self.box = None
+        self.box_ok = True
+    def clip(self, x1, y1, x2, y2):
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, self.w - 1), min(y2, self.h - 1)
+        if x1 > x2 or y1 > y2:
+            return None
+        return x1, y1, x2, y2
+    def row(self, y):
+        i = y * self.w
+        j = i + self.w
+        return memoryview(self.chs)[i:j], memoryview(self.fgs)[i:j], memoryview(self.bgs)[i:j]
+    def get_span(self, x1, x2, y):
+        i = y * self.w
+        return self.chs[i + x1:i + x2 + 1], self.fgs[i + x1:i + x2 + 1], self.bgs[i + x1:i + x2 + 1]
+    def put_span(self, x, y, chs, fgs, bgs, skip=False):
+        if self.lock or y < 0 or y >= self.h:
+            return
+        n = len(chs)
+        a, b = max(x, 0), min(x + n, self.w)
+        if a >= b:
+            return
+        if a > x or b < x + n:
+            chs, fgs, bgs = chs[a - x:b - x], fgs[a - x:b - x], bgs[a - x:b - x]
+        i = y * self.w
+        if self.cow:
+            self.own()
+        self.note(i + a, i + b)
+        self.dirty.add(y)
+        if self.dmg is not None:
+            self.dmg.add_span(a, b - 1, y)
+        if not skip:
+            self.chs[i + a:i + b] = chs
+            self.fgs[i + a:i + b] = fgs
+            self.bgs[i + a:i + b] = bgs
+            return
+        ENG.put_skip(self, i + a, chs, fgs, bgs)
+    def fill_rect(self, x1, y1, x2, y2, c, col=None, bg=None):
+        if self.lock:
+            return
+        r = self.clip(x1, y1, x2, y2)
+        if r is None:
+            return
+        x1, y1, x2, y2 = r
+        if self.cow:
+            self.own()
+        if self.dmg is not None:
+            self.dmg.add_rect(x1, y1, x2, y2)
+        if self.hist is not None:
+            for y in range(y1, y2 + 1):
+                i = y * self.w
+                self.note(i + x1, i + x2 + 1)
+        self.dirty.update(range(y1, y2 + 1))
+        ENG.fill(self, x1, y1, x2, y2, c, col, bg)
+    def open_log(self):
+        if self.base is None:
+            self.hist.touched.append(self)
+        self.log = {}
+        return self.log
+    def note(self, i, j):
+        if self.hist is None or self.base is not None:
+            return
+        lg = self.log
+        if lg is None:
+            lg = self.open_log()
+        seg = zip(range(i, j), zip(self.chs[i:j], self.fgs[i:j], self.bgs[i:j]))
+        if lg:
+            old = {k: lg[k] for k in range(i, j) if k in lg}
+            lg.update(seg)
+            lg.update(old)
+        else:
+            lg.update(seg)
+    def note_all(self):
+        if self.hist is None or self.base is not None:
+            return
+        if self.log is None:
+            self.hist.touched.append(self)
+        self.base = self.snap_with(self.log)
+        self.log = None
+    def snap_with(self, cells):
+        chs, fgs, bgs = self.chs[:], bytearray(self.fgs), bytearray(self.bgs)
+        if cells:
+            for i, (c, f, b) in cells.items():
+                chs[i] = c
+                fgs[i] = f
+                bgs[i] = b
+        return chs, bytes(fgs), bytes(bgs)
+    def take_log(self):
+        base, lg = self.base, self.log
+        self.base = None
+        self.log = None
+        if base is not None:
+            st = self.snap()
+            return None if st == base else ('snap', self, base, st)
+        cells = {}
+        chs, fgs, bgs = self.chs, self.fgs, self.bgs
+        for i, o in lg.items():
+            n = (chs[i], fgs[i], bgs[i])
+            if n != o:
+                cells[i] = (o, n)
+        if not cells:
+            return None
+        if len(cells) * 2 > self.w * self.h:
+            return ('snap', self, self.snap_with({i: o for i, (o, n) in cells.items()}), self.snap())
+        return ('cells', self, cells)
+    def apply(self, cells, k):
+        if self.cow:
+            self.own()
+        self.rehome()
+        w = self.w
+        for i, v in cells.items():
+            self.chs[i], self.fgs[i], self.bgs[i] = v[k]
+            self.dirty.add(i // w)
+            if self.dmg is not None:
+                self.dmg.add(i % w, i // w)
+        self.prune()
+    def rehome(self):
+        if self.home is not None:
+            tl, k = self.home
+            if tl.tiles.get(k) is not self:
+                tl.adopt(k, self)
+    def prune(self):
+        if self.home is None:
+            return
+        self.scan()
+        if not any(self.used):
+            tl, k = self.home
+            if tl.tiles.get(k) is self:
+                tl.drop(k)
+    def snap(self):
+        return self.chs[:], bytes(self.fgs), bytes(self.bgs)
+    def scan(self):
+        if not self.dirty:
+            return
+        w = self.w
+        for y in self.dirty:
+            i = y * w
+            n = w - self.chs[i:i + w].count(32)
+            self.occ[y] = n
+            self.used[y] = 1 if n or self.fgs.count(0, i, i + w) < w or self.bgs.count(0, i, i + w) < w else 0
+        self.edge |= self.dirty
+        self.dirty.clear()
+        self.box_ok = False
+    def row_occ(self, y):
+        if 0 <= y < self.h:
+            self.scan()
+            return self.occ[y]
+        return 0
+    def row_used(self, y):
+        if 0 <= y < self.h:
+            self.scan()
+            return self.used[y]
+        return 0
+    def ink(self):
+        self.scan()
+        return sum(self.occ)
+    def stats(self):
+        self.scan()
+        return sum(self.occ), self.h - self.occ.count(0)
+    def bbox(self):
+        self.scan()
+        if not self.box_ok:
+            w = self.w
+            for y in self.edge:
+                if self.occ[y]:
+                    t = ''.join(map(chr, self.chs[y * w:(y + 1) * w]))
+                    self.lo[y] = w - len(t.lstrip(' '))
+                    self.hi[y] = len(t.rstrip(' ')) - 1
+            self.edge.clear()
+            box = None
+            for y in range(self.h):
+                if not self.occ[y]:
+                    continue
+                if box is None:
+                    box = [self.lo[y], y, self.hi[y], y]
+                else:
+                    box[0] = min(box[0], self.lo[y])
+                    box[2] = max(box[2], self.hi[y])
+                    box[3] = y
+            self.box = box
+            self.box_ok = True
+        return None if self.box is None else list(self.box)
+    def occ_to(self, lyr):
+        lyr.occ = self.occ[:]
+        lyr.lo = self.lo[:]
+        lyr.hi = self.hi[:]
+        lyr.used = bytearray(self.used)
+        lyr.dirty = set(self.dirty)
+        lyr.edge = set(self.edge)
+        lyr.box = self.box
+        lyr.box_ok = self.box_ok
+    def own(self):
+        self.chs = self.chs[:]
+        self.fgs = bytearray(self.fgs)
+        self.bgs = bytearray(self.bgs)
+        self.cow = False
+    def freeze(self):
+        lyr = Lyr(0, 0, self.nm)
+        lyr.w, lyr.h = self.w, self.h
+        lyr.chs, lyr.fgs, lyr.bgs = self.chs, self.fgs, self.bgs
+        self.occ_to(lyr)
+        lyr.vis = self.vis
+        lyr.lock = self.lock
+        lyr.alpha = self.alpha
+        self.cow = True
+        return lyr
+    def copy(self):
+        lyr = Lyr(self.w, self.h, self.nm)
+        lyr.chs[:], lyr.fgs[:], lyr.bgs[:] = self.snap()
+        self.occ_to(lyr)
+        lyr.vis = self.vis
+        lyr.lock = self.lock
+        lyr.alpha = self.alpha
+        return lyr
+    def restore(self, st):
+        if self.cow:
+            self.own()
+        chs, fgs, bgs = st
+        self.chs[:] = chs
+        self.fgs[:] = fgs
+        self.bgs[:] = bgs
+        self.rehome()
+        self.dirty.update(range(self.h))
+        if self.dmg is not None:
+            self.dmg.add_rect(0, 0, self.w - 1, self.h - 1)
+        self.prune()
+TW, TH = 64, 16
+class OffDmg:
+    def __init__(self, dmg, ox, oy):
+        self.dmg = dmg
+        self.ox = ox
+        self.oy = oy
+    def add(self, x, y):
+        self.dmg.add(x + self.ox, y + self.oy)
+    def add_span(self, x1, x2, y):
+        self.dmg.add_span(x1 + self.ox, x2 + self.ox, y + self.oy)
+    def add_rect(self, x1, y1, x2, y2):
+        self.dmg.add_rect(x1 + self.ox, y1 + self.oy, x2 + self.ox, y2 + self.oy)
+class TLyr:
+    def __init__(self, nm="layer"):
+        self.nm = nm
+        self.tiles = {}
+        self.trows = {}
+        self.vis = True
+        self.lock = False
+        self.alpha = 1.0
+        self.dmg = None
+        self.hist = None
+    def tile(self, tx, ty):
+        t = self.tiles.get((tx, ty))
+        if t is None:
+            t = Lyr(TW, TH, self.nm)
+            if self.dmg is not None:
+                t.dmg = OffDmg(self.dmg, tx * TW, ty * TH)
+            t.hist = self.hist
+            t.home = (self, (tx, ty))
+            self.adopt((tx, ty), t)
+        return t
+    def adopt(self, k, t):
+        self.tiles[k] = t
+        self.trows.setdefault(k[1], {})[k[0]] = t
+    def drop(self, k):
+        del self.tiles[k]
+        r = self.trows[k[1]]
+        del r[k[0]]
+        if not r:
+            del self.trows[k[1]]
+    def index(self):
+        self.trows = {}
+        for (tx, ty), t in self.tiles.items():
+            t.home = (self, (tx, ty))
+            self.trows.setdefault(ty, {})[tx] = t
+        return self
+    def row_occ(self, y):
+        ly = y % TH
+        n = 0
+        for t in self.trows.get(y // TH, {}).values():
+            if t.dirty:
+                t.scan()
+            n += t.occ[ly]
+        return n
+    def row_used(self, y):
+        ly = y % TH
+        for t in self.trows.get(y // TH, {}).values():
+            if t.dirty:
+                t.scan()
+            if t.used[ly]:
+                return True
+        return False
+    def stats(self):
+        rows = 0
+        for ty, ts in self.trows.items():
+            rows += sum(1 for ly in range(TH) if any(t.row_occ(ly) for t in ts.values()))
+        return sum(t.ink() for t in self.tiles.values()), rows
+    def get(self, x, y):
+        t = self.tiles.get((x // TW, y // TH))
+        if t is None:
+            return ' '
+        return t.get(x % TW, y % TH)
+    def get_col(self, x, y):
+        t = self.tiles.get((x // TW, y // TH))
+        if t is None:
+            return 0
+        return t.get_col(x % TW, y % TH)
+    def get_bg(self, x, y):
+        t = self.tiles.get((x // TW, y // TH))
+        if t is None:
+            return 0
+        return t.get_bg(x % TW, y % TH)
+    def set(self, x, y, c, col=None, bg=None):
+        if self.lock:
+            return
+        if c == ' ' and not col and not bg and (x // TW, y // TH) not in self.tiles:
+            return
+        self.tile(x // TW, y // TH).set(x % TW, y % TH, c, col, bg)
+    def clr(self):
+        for t in list(self.tiles.values()):
+            t.clr()
+            t.prune()
+    def segs(self, x1, x2):
+        x = x1
+        while x <= x2:
+            tx = x // TW
+            e = min(x2, tx * TW + TW - 1)
+            yield tx, x, e
+            x = e + 1
+    def get_span(self, x1, x2, y):
+        n = x2 - x1 + 1
+        chs = array('I', [32]) * n
+        fgs = bytearray(n)
+        bgs = bytearray(n)
+        ty, ly = y // TH, y % TH
+        for tx, a, b in self.segs(x1, x2):
+            t = self.tiles.get((tx, ty))
+            if t is not None:
+                if t.dirty:
+                    t.scan()
+                if not t.used[ly]:
+                    continue
+                c, f, g = t.get_span(a - tx * TW, b - tx * TW, ly)
+                chs[a - x1:b - x1 + 1] = c
+                fgs[a - x1:b - x1 + 1] = f
+                bgs[a - x1:b - x1 + 1] = g
+        return chs, fgs, bgs
+    def put_span(self, x, y, chs, fgs, bgs, skip=False):
+        if self.lock or not len(chs):
+            return
+        ty, ly = y // TH, y % TH
+        for tx, a, b in self.segs(x, x + len(chs) - 1):
+            c = chs[a - x:b - x + 1]
+            f, g = fgs[a - x:b - x + 1], bgs[a - x:b - x + 1]
+            if (tx, ty) not in self.tiles and c.count(32) == len(c) and (skip or not any(f) and not any(g)):
+                continue
+            self.tile(tx, ty).put_span(a - tx * TW, ly, c, f, g, skip)
+    def fill_rect(self, x1, y1, x2, y2, c, col=None, bg=None):
+        if self.lock or x1 > x2 or y1 > y2:
+            return
+        blank = c == ' ' and not col and not bg
+        for ty in range(y1 // TH, y2 // TH + 1):
+            for tx in range(x1 // TW, x2 // TW + 1):
+                if blank and (tx, ty) not in self.tiles:
+                    continue
+                ox, oy = tx * TW, ty * TH
+                self.tile(tx, ty).fill_rect(max(x1, ox) - ox, max(y1, oy) - oy,
+                                            min(x2, ox + TW - 1) - ox, min(y2, oy + TH - 1) - oy, c, col, bg)
+    def bbox(self):
+        box = None
+        for (tx, ty), t in self.tiles.items():
+            b = t.bbox()
+            if b is None:
+                continue
+            b = [b[0] + tx * TW, b[1] + ty * TH, b[2] + tx * TW, b[3] + ty * TH]
+            if box is None:
+                box = b
+            else:
+                box = [min(box[0], b[0]), min(box[1], b[1]), max(box[2], b[2]), max(box[3], b[3])]
+        return box
+    def load_rows(self, d, cols=None, bg_cols=None, ox=0, oy=0):
+        for y, r in enumerate(d):
+            cs = array('I', (ord(c) for c in r))
+            fs = bytes(_col(c) for c in cols[y]) if cols else bytes(len(cs))
+            bs = bytes(_col(c) for c in bg_cols[y]) if bg_cols else bytes(len(cs))
+            self.put_span(ox, oy + y, cs, fs, bs)
+    def attach(self, dmg, hist):
+        self.dmg = dmg
+        self.hist = hist
+        for (tx, ty), t in self.tiles.items():
+            t.dmg = OffDmg(dmg, tx * TW, ty * TH) if dmg is not None else None
+            t.hist = hist
+        return self
+    def freeze(self):
+        lyr = TLyr(self.nm)
+        lyr.tiles = {k: t.freeze() for k, t in self.tiles.items()}
+        lyr.index()
+        lyr.vis = self.vis
+        lyr.lock = self.lock
+        lyr.alpha = self.alpha
+        return lyr
+    def copy(self):
+        lyr = TLyr(self.nm)
+        lyr.tiles = {k: t.copy() for k, t in self.tiles.items()}
+        lyr.index()
+        lyr.vis = self.vis
+        lyr.lock = self.lock
+        lyr.alpha = self.alpha
+        return lyr
+def extent(lyrs, box=None):
+    for lyr in lyrs:
+        b = lyr.bbox()
+        if b is None:
+            continue
+        if box is None:
+            box = b
+        else:
+            box = [min(box[0], b[0]), min(box[1], b[1]), max(box[2], b[2]), max(box[3], b[3])]
+    return box
+def arrow_segs(x1, y1, x2, y2):
+    segs = [((x1, y1), (x2, y2))]
+    dx = x2 - x1
+    dy = y2 - y1
+    length = math.sqrt(dx*dx + dy*dy)
+    if length > 2:
+        dx = dx / length
+        dy = dy / length
+        head_len = min(8, max(3, int(length * 0.3)))
+        perp_x = -dy
+        perp_y = dx
+        ax1 = x2 - head_len * dx + head_len * 0.4 * perp_x
+        ay1 = y2 - head_len * dy + head_len * 0.4 * perp_y
+        ax2 = x2 - head_len * dx - head_len * 0.4 * perp_x
+        ay2 = y2 - head_len * dy - head_len * 0.4 * perp_y
+        segs.append(((x2, y2), (int(ax1), int(ay1))))
+        segs.append(((x2, y2), (int(ax2), int(ay2))))
+    return segs
+def vec_rows(s, z=1.0):
+    def px(x):
+        return math.floor((x + 0.5) * z)
+    py = px
+    x1, y1, x2, y2 = s.p
+    t = max(1, round(s.thick * z))
+    r = int(math.sqrt((x2 - x1)**2 + (y2 - y1)**2))
+    cx, cy = px(x1), py(y1)
+    spans = []
+    if s.kind == "line":
+        spans = stroke_spans([(px(x1), py(y1)), (px(x2), py(y2))], t, s.cap)
+    elif s.kind == "arrow":
+        for a, b in arrow_segs(x1, y1, x2, y2):
+            spans += stroke_spans([(px(a[0]), py(a[1])), (px(b[0]), py(b[1]))], t, s.cap)
+    elif s.kind == "box":
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        a, b = math.ceil(x1 * z), math.ceil((x2 + 1) * z) - 1
+        c, d = math.ceil(y1 * z), math.ceil((y2 + 1) * z) - 1
+        for y in range(c, d + 1):
+            if s.fill or y == c or y == d:
+                spans.append((y, a, b))
+            else:
+                spans += [(y, a, a), (y, b, b)]
+    elif s.kind == "circ":
+        r = round(r * z)
+        if s.fill:
+            spans = [(cy + dy, cx + a, cx + b) for dy, a, b in ellipse_spans(r, r)]
+        else:
+            spans = [(cy + y, cx + x, cx + x) for x, y in circle_pts(r)]
+    else:
+        r = round(max(3, r) * z)
+        if s.fill:
+            spans = [(cy + dy, cx + a, cx + b) for dy, a, b in poly_spans(s.kind, r)]
+        else:
+            vs = [(cx + x, cy + y) for x, y in poly_verts(s.kind, r)]
+            spans = stroke_spans(vs + vs[:1], t, s.cap)
+    rows = {}
+    for y, a, b in spans:
+        rows.setdefault(y, []).append((a, b))
+    return rows
+class VShape:
+    def __init__(self, kind, p, fill=False, c='*', col=7, bg=0, thick=1, cap="square"):
+        self.kind = kind
+        self.p = tuple(p)
+        self.fill = fill
+        self.c = c
+        self.col = col
+        self.bg = bg
+        self.thick = thick
+        self.cap = cap
+        self.id = None
+        self.rows = None
+        self.box = None
+        self.zk = None
+        self.zrows = None
+    def raster(self, z=1.0):
+        if z == 1.0:
+            if self.rows is None:
+                self.rows = vec_rows(self)
+            return self.rows
+        if self.zk != z:
+            self.zk = z
+            self.zrows = vec_rows(self, z)
+        return self.zrows
+    def bbox(self):
+        if self.box is None:
+            rows = self.raster()
+            self.box = (min(a for r in rows.values() for a, b in r), min(rows),
+                        max(b for r in rows.values() for a, b in r), max(rows))
+        return self.box
+    def moved(self, dx, dy):
+        x1, y1, x2, y2 = self.p
+        s = VShape(self.kind, (x1 + dx, y1 + dy, x2 + dx, y2 + dy), self.fill, self.c, self.col, self.bg, self.thick, self.cap)
+        s.id = self.id
+        if self.rows is not None:
+            s.rows = {y + dy: [(a + dx, b + dx) for a, b in r] for y, r in self.rows.items()}
+        return s
+    def dump(self, ox=0, oy=0):
+        x1, y1, x2, y2 = self.p
+        return {'kind': self.kind, 'p': [x1 - ox, y1 - oy, x2 - ox, y2 - oy], 'fill': self.fill,
+                'c': self.c, 'col': self.col, 'bg': self.bg, 'thick': self.thick, 'cap': self.cap}
+def load_shape(d):
+    return VShape(d['kind'], d['p'], d.get('fill', False), d.get('c', '*'), d.get('col', 7),
+                  d.get('bg', 0), d.get('thick', 1), d.get('cap', "square"))
+class VLyr:
+    def __init__(self, nm="vector"):
+        self.nm = nm
+        self.shapes = {}
+        self.idx = {}
+        self.nid = 0
+        self.vis = True
+        self.lock = False
+        self.alpha = 1.0
+        self.dmg = None
+        self.hist = None
+    def cells(self, x1, y1, x2, y2):
+        for ty in range(y1 // TH, y2 // TH + 1):
+            for tx in range(x1 // TW, x2 // TW + 1):
+                yield tx, ty
+    def swap(self, old, new):
+        for s, add in ((old, False), (new, True)):
+            if s is None:
+                continue
+            box = s.bbox()
+            for k in self.cells(*box):
+                if add:
+                    self.idx.setdefault(k, set()).add(s.id)
+                else:
+                    ids = self.idx.get(k)
+                    if ids is not None:
+                        ids.discard(s.id)
+                        if not ids:
+                            del self.idx[k]
+            if add:
+                self.shapes[s.id] = s
+                self.nid = max(self.nid, s.id)
+            else:
+                self.shapes.pop(s.id, None)
+            if self.dmg is not None:
+                self.dmg.add_rect(box[0] - 2, box[1] - 2, box[2] + 2, box[3] + 2)
+    def put(self, old, new):
+        if self.lock:
+            return None
+        if new is not None and new.id is None:
+            new.id = self.nid + 1
+        self.swap(old, new)
+        if self.hist is not None:
+            self.hist.ops.append(('vec', self, old, new))
+        return new
+    def add(self, s):
+        return self.put(None, s)
+    def query(self, x1, y1, x2, y2):
+        ids = set()
+        for k in self.cells(x1, y1, x2, y2):
+            ids.update(self.idx.get(k, ()))
+        out = []
+        for i in sorted(ids):
+            s = self.shapes[i]
+            b = s.bbox()
+            if b[0] <= x2 and b[2] >= x1 and b[1] <= y2 and b[3] >= y1:
+                out.append(s)
+        return out
+    def hit(self, x, y):
+        for s in reversed(self.query(x, y, x, y)):
+            if any(a <= x <= b for a, b in s.raster().get(y, ())):
+                return s
+        return None
+    def view_span(self, x1, x2, y, vx=0, vy=0, z=1.0):
+        n = x2 - x1 + 1
+        chs = array('I', [32]) * n
+        fgs = bytearray(n)
+        bgs = bytearray(n)
+        if z == 1.0:
+            shapes = self.query(x1 + vx, y + vy, x2 + vx, y + vy)
+        else:
+            a, cy = vx + int(x1 / z), vy + int(y / z)
+            shapes = self.query(a - 2, cy - 2, vx + int(x2 / z) + 2, cy + 2)
+        ox, oy = math.ceil(vx * z), math.ceil(vy * z)
+        for s in shapes:
+            r = s.raster(z).get(y + oy)
+            if not r:
+                continue
+            c = array('I', [ord(s.c)])
+            for a, b in r:
+                a, b = max(a - ox, x1), min(b - ox, x2)
+                if a <= b:
+                    m = b - a + 1
+                    chs[a - x1:b - x1 + 1] = c * m
+                    fgs[a - x1:b - x1 + 1] = bytes([s.col]) * m
+                    bgs[a - x1:b - x1 + 1] = bytes([s.bg]) * m
+        return chs, fgs, bgs
+    def get_span(self, x1, x2, y):
+        return self.view_span(x1, x2, y)
+    def row_occ(self, y):
+        return len(self.shapes)
+    def row_used(self, y):
+        return len(self.shapes)
+    def stats(self):
+        b = self.bbox()
+        return len(self.shapes), 0 if b is None else b[3] - b[1] + 1
+    def get(self, x, y):
+        return chr(self.get_span(x, x, y)[0][0])
+    def get_col(self, x, y):
+        return self.get_span(x, x, y)[1][0]
+    def get_bg(self, x, y):
+        return self.get_span(x, x, y)[2][0]
+    def set(self, x, y, c, col=None, bg=None):
+        pass
+    def put_span(self, x, y, chs, fgs, bgs, skip=False):
+        pass
+    def fill_rect(self, x1, y1, x2, y2, c, col=None, bg=None):
+        pass
+    def clr(self):
+        for s in list(self.shapes.values()):
+            self.put(s, None)
+    def bbox(self):
+        box = None
+        for s in self.shapes.values():
+            b = s.bbox()
+            if box is None:
+                box = list(b)
+            else:
+                box = [min(box[0], b[0]), min(box[1], b[1]), max(box[2], b[2]), max(box[3], b[3])]
+        return box
+    def load(self, shapes, ox=0, oy=0):
+        for s in shapes:
+            s = s.moved(ox, oy)
+            if s.id is None:
+                s.id = self.nid + 1
+            self.swap(None, s)
+        return self
+    def attach(self, dmg, hist):
+        self.dmg = dmg
+        self.hist = hist
+        return self
+    def freeze(self):
+        lyr = VLyr(self.nm)
+        lyr.shapes = dict(self.shapes)
+        lyr.idx = {k: set(v) for k, v in self.idx.items()}
+        lyr.nid = self.nid
+        lyr.vis = self.vis
+        lyr.lock = self.lock
+        lyr.alpha = self.alpha
+        return lyr
+    def copy(self):
+        return self.freeze()
+    def dump(self, ox=0, oy=0):
+        return [self.shapes[i].dump(ox, oy) for i in sorted(self.shapes)]
+FILL_MODES = [
+    ("4", False, False, False),
+    ("8", True, False, False),
+    ("4 glyph", False, True, False),
+    ("8 glyph", True, True, False),
+    ("4 bg", False, False, True)
+]
+def scan_fill(lyr, x, y, box, c, col, bg, conn8=False, glyph=False, same_bg=False):
+    bx1, by1, bx2, by2 = box
+    if not (bx1 <= x <= bx2 and by1 <= y <= by2):
+        return 0
+    oc = ord(lyr.get(x, y))
+    of = lyr.get_col(x, y)
+    ob = lyr.get_bg(x, y)
+    nc = ord(c)
+    if not glyph and nc == oc and col == of and bg == ob:
+        return 0
+    w = bx2 - bx1 + 1
+    rows = {}
+    def row(ry):
+        r = rows.get(ry)
+        if r is None:
+            chs, fgs, bgs = lyr.get_span(bx1, bx2, ry)
+            if not chs.count(oc):
+                m = bytearray(w)
+            elif same_bg:
+                m = bytearray(ch == oc and (glyph or f == of) and b == ob for ch, f, b in zip(chs, fgs, bgs))
+            elif glyph:
+                m = bytearray(ch == oc for ch in chs)
+            else:
+                m = bytearray(ch == oc and f == of for ch, f in zip(chs, fgs))
+            r = rows[ry] = [chs, fgs, bgs, m, w, -1]
+        return r
+    d = 1 if conn8 else 0
+    ncs = array('I', [nc])
+    fb = bytes([col])
+    bb = bytes([bg])
+    n = 0
+    stack = [(x - bx1, y)]
+    while stack:
+        i, sy = stack.pop()
+        r = row(sy)
+        m = r[3]
+        if not m[i]:
+            continue
+        a = m.rfind(0, 0, i) + 1
+        b = m.find(0, i)
+        b = w - 1 if b < 0 else b - 1
+        k = b - a + 1
+        m[a:b + 1] = bytes(k)
+        r[0][a:b + 1] = ncs * k
+        r[1][a:b + 1] = fb * k
+        r[2][a:b + 1] = bb * k
+        r[4] = min(r[4], a)
+        r[5] = max(r[5], b)
+        n += k
+        lo, hi = max(a - d, 0), min(b + d, w - 1) + 1
+        for ny in (sy - 1, sy + 1):
+            if ny < by1 or ny > by2:
+                continue
+            nm = row(ny)[3]
+            p = nm.find(1, lo, hi)
+            while p >= 0:
+                stack.append((p, ny))
+                q = nm.find(0, p, hi)
+                if q < 0:
+                    break
+                p = nm.find(1, q, hi)
+    for ry, r in rows.items():
+        a, b = r[4], r[5]
+        if a <= b:
+            lyr.put_span(bx1 + a, ry, r[0][a:b + 1], r[1][a:b + 1], r[2][a:b + 1])
+    return n
+def _col(c):
+    if isinstance(c, str):
+        return int(c) if c.isdigit() else 0
+    return c
+SHAPES = ["circle", "square", "diamond", "soft"]
+STAMPS = {}
+def stamp(sz, shape="circle", density=1.0):
+    key = (sz, shape, density)
+    st = STAMPS.get(key)
+    if st is not None:
+        return st
+    r = sz // 2
+    spans = []
+    for dy in range(-r, r + 1):
+        run = None
+        for dx in range(-r, r + 2):
+            if dx > r:
+                on = False
+            elif shape == "square":
+                on = True
+            elif shape == "diamond":
+                on = abs(dx) + abs(dy) <= r
+            elif shape == "soft":
+                d = math.sqrt(dx * dx + dy * dy)
+                if d > r:
+                    on = False
+                elif d <= r / 2:
+                    on = True
+                else:
+                    fall = 1.0 - (d - r / 2) / (r / 2 + 0.5)
+                    on = BAYER[(dy % 4) * 4 + dx % 4] < density * 16 * fall
+            else:
+                on = dx * dx + dy * dy <= r * r
+            if on and run is None:
+                run = dx
+            elif not on and run is not None:
+                spans.append((dy, run, dx - 1))
+                run = None
+    st = STAMPS[key] = tuple(spans)
+    return st
+GEOM = {}
+def line_pts(x1, y1, x2, y2):
+    pts = []
+    dx = abs(x2 - x1)
+    dy = abs(y2 - y1)
+    sx = 1 if x1 < x2 else -1
+    sy = 1 if y1 < y2 else -1
+    err = dx - dy
+    x, y = x1, y1
+    while True:
+        pts.append((x, y))
+        if x == x2 and y == y2:
+            return pts
+        e2 = 2 * err
+        if e2 > -dy:
+            err -= dy
+            x += sx
+        if e2 < dx:
+            err += dx
+            y += sy
+def stroke_spans(pts, t=1, cap="square"):
+    if cap == "round" and t > 2:
+        st = stamp(t, "circle")
+    else:
+        o = t // 2
+        st = tuple((dy, -o, t - 1 - o) for dy in range(-o, t - o))
+    rows = defaultdict(list)
+    last = None
+    segs = [line_pts(*pts[i], *pts[i + 1]) for i in range(len(pts) - 1)] or [list(pts)]
+    for seg in segs:
+        for x, y in seg:
+            if (x, y) == last:
+                continue
+            last = (x, y)
+            for dy, a, b in st:
+                rows[y + dy].append((x + a, x + b))
+    return merge_spans(rows)
+def _verts(shape, r, asp):
+    if shape == "star":
+        pts = []
+        for i in range(10):
+            angle = i * math.pi / 5 - math.pi / 2
+            rr = r if i % 2 == 0 else r * 0.38
+            pts.append((int(rr * math.cos(angle)), int(rr * math.sin(angle) * asp)))
+        return pts
+    if shape == "tri":
+        return [(int(r * math.cos(i * 2 * math.pi / 3 - math.pi / 2)),
+                 int(r * math.sin(i * 2 * math.pi / 3 - math.pi / 2) * asp)) for i in range(3)]
+    if shape == "hex":
+        return [(int(r * math.cos(i * math.pi / 3 + math.pi / 6)),
+                 int(r * math.sin(i * math.pi / 3 + math.pi / 6) * asp)) for i in range(6)]
+    if shape == "dia":
+        ry = round(r * asp)
+        return [(0, -ry), (r, 0), (0, ry), (-r, 0)]
+    if shape == "heart":
+        pts = []
+        n = max(16, min(96, r * 2))
+        for i in range(n):
+            t = i * 2 * math.pi / n
+            x = 16 * math.sin(t) ** 3
+            y = -(13 * math.cos(t) - 5 * math.cos(2 * t) - 2 * math.cos(3 * t) - math.cos(4 * t))
+            p = (round(x * r / 16), round(y * r / 16 * asp))
+            if not pts or pts[-1] != p:
+                pts.append(p)
+        return pts
+    raise ValueError(shape)
+SHAPE_ASP = {"star": 0.6, "tri": 0.7, "hex": 0.65, "dia": 0.5, "heart": 0.5}
+def poly_verts(shape, r, asp=None):
+    if asp is None:
+        asp = SHAPE_ASP[shape]
+    key = ("v", shape, r, asp)
+    v = GEOM.get(key)
+    if v is None:
+        v = GEOM[key] = tuple(_verts(shape, r, asp))
+    return v
+def merge_spans(rows):
+    spans = []
+    for y in sorted(rows):
+        a = b = None
+        for x1, x2 in sorted(rows[y]):
+            if a is None:
+                a, b = x1, x2
+            elif x1 <= b + 1:
+                b = max(b, x2)
+            else:
+                spans.append((y, a, b))
+                a, b = x1, x2
+        spans.append((y, a, b))
+    return tuple(spans)
+def poly_spans(shape, r, asp=None):
+    if asp is None:
+        asp = SHAPE_ASP[shape]
+    key = ("f", shape, r, asp)
+    sp = GEOM.get(key)
+    if sp is not None:
+        return sp
+    vs = poly_verts(shape, r, asp)
+    rows = defaultdict(list)
+    n = len(vs)
+    for i in range(n):
+        for x, y in line_pts(*vs[i], *vs[(i + 1) % n]):
+            rows[y].append((x, x))
+    ys = [y for x, y in vs]
+    for y in range(min(ys), max(ys) + 1):
+        xs = []
+        for i in range(n):
+            (x1, y1), (x2, y2) = vs[i], vs[(i + 1) % n]
+            if y1 == y2 or not (min(y1, y2) <= y < max(y1, y2)):
+                continue
+            xs.append(x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+        xs.sort()
+        for i in range(0, len(xs) - 1, 2):
+            a, b = math.ceil(xs[i]), math.floor(xs[i + 1])
+            if a <= b:
+                rows[y].append((a, b))
+    sp = GEOM[key] = merge_spans(rows)
+    return sp
+def ellipse_spans(rx, ry):
+    key = ("e", rx, ry)
+    sp = GEOM.get(key)
+    if sp is None:
+        sp = []
+        for dy in range(-ry, ry + 1):
+            hw = math.isqrt(rx * rx * (ry * ry - dy * dy) // (ry * ry)) if ry else rx
+            sp.append((dy, -hw, hw))
+        sp = GEOM[key] = tuple(sp)
+    return sp
+def circle_pts(r):
+    key = ("c", r)
+    pts = GEOM.get(key)
+    if pts is None:
+        pts = []
+        x, y = 0, r
+        d = 3 - 2 * r
+        while True:
+            pts.extend([(x, y), (-x, y), (x, -y), (-x, -y), (y, x), (-y, x), (y, -x), (-y, -x)])
+            if y < x:
+                break
+            x += 1
+            if d > 0:
+                y -= 1
+                d = d + 4 * (x - y) + 10
+            else:
+                d = d + 4 * x + 6
+        pts = GEOM[key] = tuple(dict.fromkeys(pts))
+    return pts
 class Brush:
-    def __init__(self, sz=1, c='*', fg=7, bg=0, nm="brush"):
+    def __init__(self, sz=1, c='*', fg=7, bg=0, nm="brush", shape="circle", density=1.0):
         self.sz = sz    
         self.c = c      
         self.fg = fg    
         self.bg = bg    
         self.nm = nm    
         self.mode = 'normal'  
+        self.shape = shape
+        self.density = density
+    def spans(self):
+        return stamp(self.sz, self.shape, self.density)
     def get_pts(self, cx, cy):
         pts = []
-        if self.sz == 1:
-            pts.append((cx, cy))
-        else:
-            r = self.sz // 2
-            for dy in range(-r, r + 1):
-                for dx in range(-r, r + 1):
-                    if dx*dx + dy*dy <= r*r:
-                        pts.append((cx + dx, cy + dy))
+        for dy, a, b in self.spans():
+            for dx in range(a, b + 1):
+                pts.append((cx + dx, cy + dy))
         return pts
     def draw(self, lyr, x, y, c=None, col=None, bg=None):
         if c is None:
@@ -83,110 +1255,938 @@ class Brush:
             col = self.fg
         if bg is None:
             bg = self.bg
-        pts = self.get_pts(x, y)
-        for px, py in pts:
-            lyr.set(px, py, c, col, bg)
+        for dy, a, b in self.spans():
+            lyr.fill_rect(x + a, y + dy, x + b, y + dy, c, col, bg)
+def _pat_wave():
+    pts = []
+    for i in range(-5, 6):
+        wy = math.floor(2 * math.sin(i * 0.5))
+        pts.append((i, wy, '~'))
+        pts.append((i, wy + 1, '≈'))
+    return pts
+def _pat_mesh():
+    pts = []
+    for dx in range(-3, 4):
+        for dy in range(-3, 4):
+            if dx % 2 == 0 and dy % 2 == 0:
+                pts.append((dx, dy, 'o'))
+            elif dx % 2 == 0:
+                pts.append((dx, dy, '|'))
+            elif dy % 2 == 0:
+                pts.append((dx, dy, '-'))
+    return pts
+def _pat_dots():
+    pts = []
+    for i in range(8):
+        angle = i * math.pi / 4
+        pts.append((int(2 * math.cos(angle)), int(2 * math.sin(angle)), '•'))
+    return pts
+def _pat_cross():
+    pts = []
+    for i in range(-3, 4):
+        pts.append((i, 0, '#'))
+        pts.append((0, i, '#'))
+    pts.append((0, 0, '+'))
+    return pts
+def _pat_spiral():
+    pts = []
+    for i in range(20):
+        t = i * 0.3
+        r = i * 0.2
+        pts.append((math.floor(r * math.cos(t)), math.floor(r * math.sin(t)), ['*', '#', '@', '%'][i % 4]))
+    return pts
+def _pat_brick():
+    pts = []
+    for dy in range(-2, 3):
+        for dx in range(-4, 5):
+            if dy % 2 == 0:
+                if dx % 4 == 0:
+                    pts.append((dx, dy, '#'))
+            else:
+                if (dx + 2) % 4 == 0:
+                    pts.append((dx, dy, '#'))
+    return pts
+def _pat_hash():
+    pts = []
+    for i in range(-2, 3):
+        if i != 0:
+            pts.append((i, -1, '#'))
+            pts.append((i, 1, '#'))
+            pts.append((-1, i, '#'))
+            pts.append((1, i, '#'))
+    return pts
+def _pat_circle():
+    pts = []
+    r = 3
+    for angle in range(0, 360, 30):
+        rad = math.radians(angle)
+        pts.append((math.floor(round(r * math.cos(rad), 9)), math.floor(round(r * math.sin(rad), 9)), 'o'))
+    return pts
+def _pat_arrow():
+    return [(0, 0, '>'), (-1, 0, '-'), (-2, 0, '-'), (1, -1, '/'), (1, 1, '\\')]
+def _pat_star():
+    return [(0, 0, '*'), (0, -1, '|'), (0, 1, '|'), (-1, 0, '-'), (1, 0, '-'),
+            (-1, -1, '\\'), (1, -1, '/'), (-1, 1, '/'), (1, 1, '\\')]
+PAT_GENS = {
+    "wave": _pat_wave,
+    "mesh": _pat_mesh,
+    "dots": _pat_dots,
+    "cross": _pat_cross,
+    "spiral": _pat_spiral,
+    "brick": _pat_brick,
+    "hash": _pat_hash,
+    "circle": _pat_circle,
+    "arrow": _pat_arrow,
+    "star": _pat_star,
+}
+PATS = {}
+def compile_pat(pts):
+    cells = {}
+    for dx, dy, g in pts:
+        cells[(dx, dy)] = g
+    if not cells:
+        return ((), (0, 0, -1, -1))
+    x1 = min(dx for dx, dy in cells)
+    x2 = max(dx for dx, dy in cells)
+    y1 = min(dy for dx, dy in cells)
+    y2 = max(dy for dx, dy in cells)
+    rows = []
+    for dy in range(y1, y2 + 1):
+        xs = [dx for dx in range(x1, x2 + 1) if (dx, dy) in cells]
+        if not xs:
+            continue
+        a, b = xs[0], xs[-1]
+        chs = array('I', [32]) * (b - a + 1)
+        for dx in xs:
+            chs[dx - a] = ord(cells[(dx, dy)])
+        rows.append((dy, a, chs))
+    return (tuple(rows), (x1, y1, x2, y2))
+def pat_stamp(nm):
+    st = PATS.get(nm)
+    if st is None:
+        st = PATS[nm] = compile_pat(PAT_GENS.get(nm, list)())
+    return st
+def load_pats(fname):
+    try:
+        with open(fname, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    blocks = []
+    for ln in lines:
+        if ln.startswith('[') and ln.rstrip().endswith(']'):
+            blocks.append((ln.strip()[1:-1], []))
+        elif blocks:
+            blocks[-1][1].append(ln.rstrip())
+    pats = {}
+    for nm, art in blocks:
+        while art and not art[-1]:
+            art.pop()
+        if not art:
+            continue
+        cx = max(len(ln) for ln in art) // 2
+        cy = len(art) // 2
+        pts = []
+        for y, ln in enumerate(art):
+            for x, g in enumerate(ln):
+                if g != ' ':
+                    pts.append((x - cx, y - cy, g))
+        pats[nm] = compile_pat(pts)
+    return pats
 class Pat:
-    def __init__(self, nm="pat"):
+    def __init__(self, nm="pat", st=None):
         self.nm = nm
         self.sz = 5
+        self.rows, self.box = st or pat_stamp(nm)
     def apply(self, lyr, x, y, col=0, bg=0):
-        if self.nm == "wave":
-            self._wave(lyr, x, y, col, bg)
-        elif self.nm == "mesh":
-            self._mesh(lyr, x, y, col, bg) 
-        elif self.nm == "dots":
-            self._dots(lyr, x, y, col, bg)
-        elif self.nm == "cross":
-            self._cross(lyr, x, y, col, bg)
-        elif self.nm == "spiral":
-            self._spiral(lyr, x, y, col, bg)
-        elif self.nm == "brick":
-            self._brick(lyr, x, y, col, bg)
-        elif self.nm == "hash":
-            self._hash(lyr, x, y, col, bg)
-        elif self.nm == "circle":
-            self._circle(lyr, x, y, col, bg)
-        elif self.nm == "arrow":
-            self._arrow(lyr, x, y, col, bg)
-        elif self.nm == "star":
-            self._star(lyr, x, y, col, bg)
-    def _wave(self, lyr, x, y, col=0, bg=0):
-        for i in range(-5, 6):
-            wx = x + i
-            wy = int(y + 2 * math.sin(i * 0.5))
-            lyr.set(wx, wy, '~', col, bg)
-            lyr.set(wx, wy + 1, '≈', col, bg)
-    def _mesh(self, lyr, x, y, col=0, bg=0):
-        for dx in range(-3, 4):
-            for dy in range(-3, 4):
-                if dx % 2 == 0 and dy % 2 == 0:
-                    lyr.set(x + dx, y + dy, 'o', col, bg)
-                elif dx % 2 == 0:
-                    lyr.set(x + dx, y + dy, '|', col, bg)
-                elif dy % 2 == 0:
-                    lyr.set(x + dx, y + dy, '-', col, bg)
-    def _dots(self, lyr, x, y, col=0, bg=0):
-        for i in range(8):
-            angle = i * math.pi / 4
-            dx = int(2 * math.cos(angle))
-            dy = int(2 * math.sin(angle))
-            lyr.set(x + dx, y + dy, '•', col, bg)
-    def _cross(self, lyr, x, y, col=0, bg=0):
-        for i in range(-3, 4):
-            lyr.set(x + i, y, '#', col, bg)
-            lyr.set(x, y + i, '#', col, bg)
-        lyr.set(x, y, '+', col, bg)
-    def _spiral(self, lyr, x, y, col=0, bg=0):
-        for i in range(20):
-            t = i * 0.3
-            r = i * 0.2
-            sx = int(x + r * math.cos(t))
-            sy = int(y + r * math.sin(t))
-            ch = ['*', '#', '@', '%'][i % 4]
-            lyr.set(sx, sy, ch, col, bg)
-    def _brick(self, lyr, x, y, col=0, bg=0):
-        for dy in range(-2, 3):
-            for dx in range(-4, 5):
-                if dy % 2 == 0:
-                    if dx % 4 == 0:
-                        lyr.set(x + dx, y + dy, '#', col, bg)
+        for dy, dx, chs in self.rows:
+            n = len(chs)
+            lyr.put_span(x + dx, y + dy, chs, bytes([col]) * n, bytes([bg]) * n, skip=True)
+    def tile(self, lyr, x1, y1, x2, y2, col=0, bg=0):
+        bx1, by1, bx2, by2 = self.box
+        pw = bx2 - bx1 + 1
+        ph = by2 - by1 + 1
+        if pw <= 0 or x1 > x2 or y1 > y2:
+            return
+        grid = [array('I', [32]) * pw for _ in range(ph)]
+        for dy, dx, chs in self.rows:
+            grid[dy - by1][dx - bx1:dx - bx1 + len(chs)] = chs
+        w = x2 - x1 + 1
+        fgs = bytes([col]) * w
+        bgs = bytes([bg]) * w
+        reps = {}
+        for y in range(y1, y2 + 1):
+            k = (y - y1) % ph
+            r = reps.get(k)
+            if r is None:
+                r = reps[k] = (grid[k] * (w // pw + 1))[:w]
+            lyr.put_span(x1, y, r, fgs, bgs, skip=True)
+MIRROR_H = str.maketrans("/\\()<>[]{}", "\\/)(><][}{")
+MIRROR_V = str.maketrans("/\\^v", "\\/v^")
+ROT_CW = str.maketrans("-|/\\<>^v", "|-\\/^v><")
+def _tr(chs, tbl):
+    return array('I', [tbl.get(c, c) for c in chs])
+def grab(lyr, x1, y1, x2, y2):
+    runs = []
+    for y in range(y1, y2 + 1):
+        if not lyr.row_occ(y):
+            continue
+        chs, fgs, bgs = lyr.get_span(x1, x2, y)
+        if chs.count(32) == len(chs):
+            continue
+        for m in re.finditer(r'[^ ]+', ''.join(map(chr, chs))):
+            a, b = m.span()
+            runs.append((y - y1, a, chs[a:b], bytes(fgs[a:b]), bytes(bgs[a:b])))
+    return runs
+def cell_runs(cells):
+    runs = []
+    run = None
+    for y, x in sorted(cells):
+        c, f, b = cells[(y, x)]
+        if run is not None and run[0] == y and run[1] + len(run[2]) == x:
+            run[2].append(c)
+            run[3].append(f)
+            run[4].append(b)
+        else:
+            run = [y, x, array('I', [c]), bytearray([f]), bytearray([b])]
+            runs.append(run)
+    return [(y, x, c, bytes(f), bytes(b)) for y, x, c, f, b in runs]
+class Clip:
+    def __init__(self, w, h, parts):
+        self.w = w
+        self.h = h
+        self.parts = parts
+    def remap(self, w, h, fn, tbl=None):
+        parts = []
+        for li, runs in self.parts:
+            cells = {}
+            for y, x, chs, fgs, bgs in runs:
+                for i, c in enumerate(chs):
+                    v = (tbl.get(c, c) if tbl else c, fgs[i], bgs[i])
+                    for p in fn(x + i, y):
+                        cells[p] = v
+            parts.append((li, cell_runs(cells)))
+        return Clip(w, h, parts)
+    def flip_h(self):
+        w = self.w
+        return Clip(w, self.h, [(li, [(y, w - x - len(chs), _tr(chs[::-1], MIRROR_H), fgs[::-1], bgs[::-1])
+                                      for y, x, chs, fgs, bgs in runs]) for li, runs in self.parts])
+    def flip_v(self):
+        h = self.h
+        return Clip(self.w, h, [(li, [(h - 1 - y, x, _tr(chs, MIRROR_V), fgs, bgs)
+                                      for y, x, chs, fgs, bgs in sorted(runs, key=lambda r: -r[0])]) for li, runs in self.parts])
+    def rot90(self):
+        h = self.h
+        return self.remap(h, self.w, lambda x, y: ((x, h - 1 - y),), ROT_CW)
+    def scale(self, s):
+        def rng(v):
+            a = int(v * s)
+            return range(a, max(a + 1, int((v + 1) * s)))
+        def fn(x, y):
+            return [(j, i) for j in rng(y) for i in rng(x)]
+        w = max(int(self.w * s), int((self.w - 1) * s) + 1)
+        h = max(int(self.h * s), int((self.h - 1) * s) + 1)
+        return self.remap(w, h, fn)
+MAGIC = b'DOTB'
+BIN_VER = 3
+_HDR = struct.Struct('<4sHHII')
+_ORG = struct.Struct('<ii')
+_IDX = struct.Struct('<IIBH')
+_RUN = struct.Struct('<HIBB')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+def _rle_row(chs, fgs, bgs):
+    runs = []
+    n = len(chs)
+    x = 0
+    while x < n:
+        c, f, b = chs[x], fgs[x], bgs[x]
+        e = x + 1
+        while e < n and e - x < 0xffff and chs[e] == c and fgs[e] == f and bgs[e] == b:
+            e += 1
+        runs.append(_RUN.pack(e - x, c, f, b))
+        x = e
+    return _U16.pack(len(runs)) + b''.join(runs)
+def _unrle_row(buf, off):
+    n, = _U16.unpack_from(buf, off)
+    runs = list(_RUN.iter_unpack(buf[off + 2:off + 2 + n * _RUN.size]))
+    x = 0
+    while runs and runs[0][1:] == (32, 0, 0):
+        x += runs.pop(0)[0]
+    while runs and runs[-1][1:] == (32, 0, 0):
+        runs.pop()
+    chs = array('I')
+    fgs = bytearray()
+    bgs = bytearray()
+    for cnt, c, f, b in runs:
+        chs.extend(array('I', [c]) * cnt)
+        fgs += bytes([f]) * cnt
+        bgs += bytes([b]) * cnt
+    return x, chs, fgs, bgs
+def write_bin(fname, w, h, lyrs, sync=False, prog=None, org=(0, 0)):
+    ox, oy = org
+    blocks = []
+    blank = _rle_row(array('I', [32]) * w, bytes(w), bytes(w))
+    for i, lyr in enumerate(lyrs):
+        if prog:
+            prog(i, len(lyrs))
+        if isinstance(lyr, VLyr):
+            blocks.append(json.dumps(lyr.dump(ox, oy)).encode('utf-8'))
+            continue
+        tbl = []
+        rows = [blank]
+        off = 4 * h + len(blank)
+        for y in range(h):
+            r = _rle_row(*lyr.get_span(ox, ox + w - 1, oy + y)) if lyr.row_used(oy + y) else blank
+            if r == blank:
+                tbl.append(_U32.pack(4 * h))
+                continue
+            tbl.append(_U32.pack(off))
+            rows.append(r)
+            off += len(r)
+        blocks.append(b''.join(tbl) + b''.join(rows))
+    idx = []
+    names = [lyr.nm.encode('utf-8') for lyr in lyrs]
+    off = _HDR.size + _ORG.size + sum(_IDX.size + len(nm) for nm in names)
+    for lyr, nm, blk in zip(lyrs, names, blocks):
+        flags = (1 if lyr.vis else 0) | (2 if lyr.lock else 0) | (4 if isinstance(lyr, VLyr) else 0) | (min(15, round((1.0 - lyr.alpha) * 16)) << 4)
+        idx.append(_IDX.pack(off, len(blk), flags, len(nm)) + nm)
+        off += len(blk)
+    with open(fname, 'wb') as f:
+        f.write(_HDR.pack(MAGIC, BIN_VER, len(lyrs), w, h))
+        f.write(_ORG.pack(ox, oy))
+        f.write(b''.join(idx))
+        for blk in blocks:
+            f.write(blk)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+class BinDoc:
+    def __init__(self, fname):
+        self.f = open(fname, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, ver, n, self.w, self.h = _HDR.unpack_from(self.mm, 0)
+        if magic != MAGIC or ver > BIN_VER:
+            self.close()
+            raise ValueError("not a drawing file")
+        self.lyrs = []
+        off = _HDR.size
+        self.org = (0, 0)
+        if ver >= 2:
+            self.org = _ORG.unpack_from(self.mm, off)
+            off += _ORG.size
+        for _ in range(n):
+            lo, ln, flags, nl = _IDX.unpack_from(self.mm, off)
+            off += _IDX.size
+            nm = self.mm[off:off + nl].decode('utf-8')
+            off += nl
+            self.lyrs.append((nm, flags, lo, ln))
+        self.blank = _rle_row(array('I', [32]) * self.w, bytes(self.w), bytes(self.w))
+    def row(self, i, y):
+        lo = self.lyrs[i][2]
+        ro, = _U32.unpack_from(self.mm, lo + 4 * y)
+        if self.mm[lo + ro:lo + ro + len(self.blank)] == self.blank:
+            return None
+        return _unrle_row(self.mm, lo + ro)
+    def layer(self, i):
+        nm, flags, lo, ln = self.lyrs[i]
+        ox, oy = self.org
+        if flags & 4:
+            lyr = VLyr(nm).load([load_shape(d) for d in json.loads(self.mm[lo:lo + ln].decode('utf-8'))], ox, oy)
+        else:
+            lyr = TLyr(nm)
+            for y in range(self.h):
+                r = self.row(i, y)
+                if r is not None:
+                    x, chs, fgs, bgs = r
+                    lyr.put_span(ox + x, oy + y, chs, fgs, bgs)
+        lyr.vis = bool(flags & 1)
+        lyr.lock = bool(flags & 2)
+        lyr.alpha = 1.0 - (flags >> 4) / 16
+        return lyr
+    def close(self):
+        self.mm.close()
+        self.f.close()
+def write_json(fname, w, h, lyrs, sync=False, prog=None, org=(0, 0)):
+    ox, oy = org
+    data = {
+        'width': w,
+        'height': h,
+        'x': ox,
+        'y': oy,
+        'layers': []
+    }
+    for i, lyr in enumerate(lyrs):
+        if prog:
+            prog(i, len(lyrs))
+        if isinstance(lyr, VLyr):
+            data['layers'].append({
+                'name': lyr.nm,
+                'visible': lyr.vis,
+                'alpha': lyr.alpha,
+                'shapes': lyr.dump(ox, oy)
+            })
+            continue
+        rows = []
+        for y in range(h):
+            if not lyr.row_used(oy + y):
+                continue
+            chs, fgs, bgs = lyr.get_span(ox, ox + w - 1, oy + y)
+            t = ''.join(map(chr, chs))
+            a = min(w - len(t.lstrip(' ')), w - len(fgs.lstrip(b'\0')), w - len(bgs.lstrip(b'\0')))
+            b = max(len(t.rstrip(' ')), len(fgs.rstrip(b'\0')), len(bgs.rstrip(b'\0')))
+            if a < b:
+                rows.append([y, a, t[a:b], list(fgs[a:b]), list(bgs[a:b])])
+        lyr_data = {
+            'name': lyr.nm,
+            'visible': lyr.vis,
+            'alpha': lyr.alpha,
+            'rows': rows
+        }
+        data['layers'].append(lyr_data)
+    with open(fname, 'w') as f:
+        json.dump(data, f)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+def read_json(fname):
+    with open(fname, 'r') as f:
+        data = json.load(f)
+    w = data['width']
+    h = data['height']
+    ox, oy = data.get('x', 0), data.get('y', 0)
+    lyrs = []
+    for lyr_data in data['layers']:
+        if 'shapes' in lyr_data:
+            lyr = VLyr(lyr_data['name']).load([load_shape(d) for d in lyr_data['shapes']], ox, oy)
+        elif 'rows' in lyr_data:
+            lyr = TLyr(lyr_data['name'])
+            for y, x, t, fs, bs in lyr_data['rows']:
+                lyr.put_span(ox + x, oy + y, array('I', map(ord, t)), bytes(fs), bytes(bs))
+        else:
+            lyr = TLyr(lyr_data['name'])
+            lyr.load_rows(lyr_data['data'], lyr_data.get('colors'), lyr_data.get('bg_colors'), ox, oy)
+        lyr.vis = lyr_data['visible']
+        lyr.alpha = lyr_data.get('alpha', 1.0)
+        lyrs.append(lyr)
+    return w, h, lyrs, (ox, oy)
+def is_bin(fname):
+    with open(fname, 'rb') as f:
+        return f.read(4) == MAGIC
+def read_drawing(fname):
+    if not is_bin(fname):
+        return read_json(fname)
+    doc = BinDoc(fname)
+    try:
+        return doc.w, doc.h, [doc.layer(i) for i in range(len(doc.lyrs))], doc.org
+    finally:
+        doc.close()
+def write_drawing(fname, w, h, lyrs, sync=False, prog=None, org=(0, 0)):
+    tmp = fname + '.tmp'
+    if fname.endswith('.json'):
+        write_json(tmp, w, h, lyrs, sync, prog, org)
+    else:
+        write_bin(tmp, w, h, lyrs, sync, prog, org)
+    os.replace(tmp, fname)
+def convert(src, dst):
+    w, h, lyrs, org = read_drawing(src)
+    write_drawing(dst, w, h, lyrs, org=org)
+class Autosave:
+    def __init__(self, fname="drawing.autosave.dtb", every=30.0, edits=50):
+        self.fname = fname
+        self.every = every
+        self.edits = edits
+        self.n = 0
+        self.last_t = time.time()
+        self.last_ms = None
+        self.prog = 0.0
+        self.saves = 0
+        self.err = None
+        self.q = queue.Queue()
+        self.th = None
+    def start(self):
+        if self.th is None:
+            self.th = threading.Thread(target=self.work, daemon=True)
+            self.th.start()
+    def stop(self):
+        if self.th is not None:
+            self.q.put(None)
+            self.th.join()
+            self.th = None
+    def edit(self):
+        self.n += 1
+    def busy(self):
+        with self.q.mutex:
+            return self.q.unfinished_tasks
+    def wait(self):
+        if self.busy():
+            return 0.1
+        if not self.n or not self.every:
+            return None
+        return max(0.0, self.last_t + self.every - time.time())
+    def due(self):
+        if not self.n or self.busy():
+            return False
+        if self.edits and self.n >= self.edits:
+            return True
+        return bool(self.every) and time.time() - self.last_t >= self.every
+    def submit(self, fname, w, h, lyrs, org=(0, 0)):
+        self.start()
+        self.n = 0
+        self.last_t = time.time()
+        self.q.put((fname, w, h, org, [lyr.freeze() for lyr in lyrs]))
+    def set_prog(self, i, n):
+        self.prog = i / n if n else 0.0
+    def work(self):
+        while True:
+            job = self.q.get()
+            if job is None:
+                self.q.task_done()
+                break
+            fname, w, h, org, lyrs = job
+            t0 = time.perf_counter()
+            self.prog = 0.0
+            try:
+                write_drawing(fname, w, h, lyrs, True, self.set_prog, org)
+                self.last_ms = (time.perf_counter() - t0) * 1000
+                self.saves += 1
+                self.err = None
+            except Exception as e:
+                self.err = str(e)
+            self.q.task_done()
+    def status(self):
+        if self.busy():
+            return f"Saving {int(self.prog * 100)}%"
+        if self.err:
+            return "Save failed"
+        if self.last_ms is not None:
+            return f"Saved {self.last_ms:.0f}ms"
+        return ""
+class Prof:
+    PH = ["input", "dispatch", "tool", "save", "compose", "draw", "refresh"]
+    def __init__(self, n=300):
+        self.hist = {p: deque(maxlen=n) for p in self.PH}
+        self.cur = dict.fromkeys(self.PH, 0.0)
+        self.ev = deque(maxlen=100000)
+        self.rec = False
+        self.work = False
+        self.t0 = time.perf_counter()
+    def add(self, ph, t, sub=0.0):
+        now = time.perf_counter()
+        self.cur[ph] += now - t - sub
+        self.work = True
+        if self.rec:
+            self.ev.append((ph, t, now))
+        return now
+    def frame(self):
+        for p in self.PH:
+            if self.work:
+                self.hist[p].append(self.cur[p])
+            self.cur[p] = 0.0
+        self.work = False
+    def stats(self):
+        res = []
+        for p in self.PH:
+            ts = sorted(self.hist[p])
+            if ts:
+                res.append((p, ts[len(ts) // 2] * 1000, ts[min(len(ts) - 1, len(ts) * 99 // 100)] * 1000))
+            else:
+                res.append((p, 0.0, 0.0))
+        return res
+    def text(self):
+        lines = ["phase     p50ms  p99ms"]
+        for p, a, b in self.stats():
+            lines.append(f"{p:<8}{a:7.2f}{b:7.2f}")
+        return tuple(lines)
+    def dump(self, fname):
+        pid = os.getpid()
+        evs = [{"name": ph, "cat": "frame", "ph": "X", "pid": pid, "tid": 1,
+                "ts": (t - self.t0) * 1e6, "dur": (e - t) * 1e6} for ph, t, e in list(self.ev)]
+        with open(fname, 'w') as f:
+            json.dump({"traceEvents": evs, "displayTimeUnit": "ms"}, f)
+        return len(evs)
+class Journal:
+    def __init__(self, fname, seed, w, h):
+        try:
+            if os.path.getsize(fname) > JOURNAL_MAX:
+                os.replace(fname, fname + '.1')
+        except OSError:
+            pass
+        self.f = open(fname, 'a', encoding='utf-8')
+        if self.f.tell():
+            self.f.write('\n')
+        self.t0 = time.perf_counter()
+        self.frame = 0
+        self.q = queue.Queue()
+        self.th = threading.Thread(target=self.work, daemon=True)
+        self.th.start()
+        self.write({"v": 1, "seed": seed, "w": w, "h": h, "time": time.time()})
+    def write(self, rec):
+        self.q.put(rec)
+    def ev(self, kind, v):
+        self.write({"f": self.frame, "t": round(time.perf_counter() - self.t0, 4), kind: v})
+    def flush(self):
+        self.q.put(True)
+    def work(self):
+        while True:
+            rec = self.q.get()
+            if rec is None:
+                break
+            try:
+                if rec is True:
+                    self.f.flush()
                 else:
-                    if (dx + 2) % 4 == 0:
-                        lyr.set(x + dx, y + dy, '#', col, bg)
-    def _hash(self, lyr, x, y, col=0, bg=0):
-        for i in range(-2, 3):
-            if i != 0:
-                lyr.set(x + i, y - 1, '#', col, bg)
-                lyr.set(x + i, y + 1, '#', col, bg)
-                lyr.set(x - 1, y + i, '#', col, bg)
-                lyr.set(x + 1, y + i, '#', col, bg)
-    def _circle(self, lyr, x, y, col=0, bg=0):
-        r = 3
-        for angle in range(0, 360, 30):
-            rad = math.radians(angle)
-            cx = int(x + r * math.cos(rad))
-            cy = int(y + r * math.sin(rad))
-            lyr.set(cx, cy, 'o', col, bg)
-    def _arrow(self, lyr, x, y, col=0, bg=0):
-        lyr.set(x, y, '>', col, bg)
-        lyr.set(x - 1, y, '-', col, bg)
-        lyr.set(x - 2, y, '-', col, bg)
-        lyr.set(x + 1, y - 1, '/', col, bg)
-        lyr.set(x + 1, y + 1, '\\', col, bg)
-    def _star(self, lyr, x, y, col=0, bg=0):
-        lyr.set(x, y, '*', col, bg)
-        lyr.set(x, y - 1, '|', col, bg)
-        lyr.set(x, y + 1, '|', col, bg)
-        lyr.set(x - 1, y, '-', col, bg)
-        lyr.set(x + 1, y, '-', col, bg)
-        lyr.set(x - 1, y - 1, '\\', col, bg)
-        lyr.set(x + 1, y - 1, '/', col, bg)
-        lyr.set(x - 1, y + 1, '/', col, bg)
-        lyr.set(x + 1, y + 1, '\\', col, bg)
-class App:
+                    self.f.write(json.dumps(rec, separators=(',', ':')) + '\n')
+            except OSError:
+                pass
+        self.f.close()
+    def close(self):
+        if self.th is not None:
+            self.q.put(None)
+            self.th.join()
+            self.th = None
+def read_journal(fname):
+    sess = []
+    with open(fname, encoding='utf-8') as f:
+        for ln in f:
+            try:
+                rec = json.loads(ln)
+            except ValueError:
+                continue
+            if "v" in rec:
+                sess.append((rec, []))
+            elif sess:
+                sess[-1][1].append(rec)
+    return sess
+class HScr:
+    def __init__(self, w=80, h=24, keys=()):
+        self.w, self.h = w, h
+        self.keys = deque(keys)
+        self.mq = deque()
+        self.y = self.x = 0
+        self.to = -1
+        self.erase()
+    def erase(self):
+        self.g = [[(' ', 0)] * self.w for _ in range(self.h)]
+    clear = erase
+    def getmaxyx(self):
+        return self.h, self.w
+    def move(self, y, x):
+        if not (0 <= y < self.h and 0 <= x < self.w):
+            raise curses.error
+        self.y, self.x = y, x
+    def put(self, c, a):
+        self.g[self.y][self.x] = (c, a)
+        self.x += 1
+        if self.x >= self.w:
+            self.x = 0
+            self.y += 1
+            if self.y >= self.h:
+                self.y = self.h - 1
+                raise curses.error
+    def addch(self, y, x, c, a=0):
+        self.move(y, x)
+        self.put(c if isinstance(c, str) else chr(c), a)
+    def addstr(self, y, x, t, a=0):
+        self.move(y, x)
+        for c in t:
+            self.put(c, a)
+    def addnstr(self, y, x, t, n, a=0):
+        self.addstr(y, x, t[:n], a)
+    def getch(self):
+        if self.keys:
+            return self.keys.popleft()
+        if self.to < 0:
+            raise EOFError("headless input exhausted")
+        return -1
+    def nodelay(self, v):
+        pass
+    def keypad(self, v):
+        pass
+    def timeout(self, v):
+        self.to = v
+    def refresh(self):
+        pass
+    def noutrefresh(self):
+        pass
+    def text(self):
+        return '\n'.join(''.join(c for c, a in r) for r in self.g)
+class HTerm:
     def __init__(self, scr):
         self.scr = scr
+    def curs_set(self, v):
+        pass
+    def has_colors(self):
+        return True
+    def start_color(self):
+        pass
+    def use_default_colors(self):
+        pass
+    def init_pair(self, n, fg, bg):
+        pass
+    def color_pair(self, n):
+        return n << 8
+    def mousemask(self, m):
+        return m, 0
+    def mouseinterval(self, v):
+        pass
+    def flushinp(self):
+        pass
+    def getmouse(self):
+        if not self.scr.mq:
+            raise curses.error
+        return self.scr.mq.popleft()
+CSI_KEYS = {
+    'A': curses.KEY_UP, 'B': curses.KEY_DOWN, 'C': curses.KEY_RIGHT, 'D': curses.KEY_LEFT,
+    'H': curses.KEY_HOME, 'F': curses.KEY_END,
+    '1;2A': curses.KEY_SR, '1;2B': curses.KEY_SF, '1;2C': curses.KEY_SRIGHT, '1;2D': curses.KEY_SLEFT,
+    '3~': curses.KEY_DC, '5~': curses.KEY_PPAGE, '6~': curses.KEY_NPAGE,
+}
+class AnsiScr(HScr):
+    def __init__(self, fin=0, fout=1, w=None, h=None):
+        if w is None or h is None:
+            w, h = os.get_terminal_size(fout)
+        HScr.__init__(self, w, h)
+        self.fin, self.fout = fin, fout
+        self.prev = None
+        self.buf = b''
+        self.pairs = {}
+        self.sgrs = {}
+        self.cur = None
+        self.cattr = None
+        self.nbytes = 0
+        self.out_bytes = 0
+        self.frames = 0
+        self.saved = None
+    def start(self):
+        try:
+            self.saved = termios.tcgetattr(self.fin)
+            tty.setcbreak(self.fin)
+        except termios.error:
+            self.saved = None
+        self.emit('\033[?1049h\033[?25l\033[?1000h\033[?1002h\033[?1003h\033[?1006h\033[0m\033[2J')
+    def stop(self):
+        self.emit('\033[?1006l\033[?1003l\033[?1002l\033[?1000l\033[0m\033[?25h\033[?1049l')
+        if self.saved is not None:
+            termios.tcsetattr(self.fin, termios.TCSADRAIN, self.saved)
+    def emit(self, out):
+        data = out.encode('utf-8')
+        view = memoryview(data)
+        while view:
+            n = os.write(self.fout, view)
+            view = view[n:]
+        return len(data)
+    def clear(self):
+        self.erase()
+        self.prev = None
+    def sgr(self, attr):
+        s = self.sgrs.get(attr)
+        if s is None:
+            ps = ['0']
+            if attr & curses.A_BOLD:
+                ps.append('1')
+            if attr & curses.A_DIM:
+                ps.append('2')
+            if attr & curses.A_BLINK:
+                ps.append('5')
+            if attr & (curses.A_REVERSE | curses.A_STANDOUT):
+                ps.append('7')
+            fg, bg = self.pairs.get((attr & curses.A_COLOR) >> 8, (-1, -1))
+            if fg >= 0:
+                ps.append(str(30 + fg) if fg < 8 else f"38;5;{fg}")
+            if bg >= 0:
+                ps.append(str(40 + bg) if bg < 8 else f"48;5;{bg}")
+            s = self.sgrs[attr] = '\033[' + ';'.join(ps) + 'm'
+        return s
+    def refresh(self):
+        out = []
+        if self.prev is None:
+            out.append('\033[0m\033[2J')
+            self.prev = [[(' ', 0)] * self.w for _ in range(self.h)]
+            self.cur = None
+            self.cattr = 0
+        cur, cattr = self.cur, self.cattr
+        for y in range(self.h):
+            row, prow = self.g[y], self.prev[y]
+            if row == prow:
+                continue
+            for x in range(self.w):
+                c, a = row[x]
+                if prow[x] == (c, a):
+                    continue
+                gap = x - cur[1] if cur and cur[0] == y else -1
+                if 0 < gap <= 4 and all(row[i][1] == cattr for i in range(cur[1], x)):
+                    out.extend(row[i][0] for i in range(cur[1], x))
+                elif gap != 0:
+                    out.append(f"\033[{y + 1};{x + 1}H")
+                if a != cattr:
+                    out.append(self.sgr(a))
+                    cattr = a
+                out.append(c)
+                cur = (y, x + 1) if x + 1 < self.w else None
+            self.prev[y] = row[:]
+        self.cur, self.cattr = cur, cattr
+        self.nbytes = self.emit(''.join(out)) if out else 0
+        self.out_bytes += self.nbytes
+        self.frames += 1
+    def noutrefresh(self):
+        pass
+    def fill(self, wait):
+        while True:
+            try:
+                r, _, _ = select.select([self.fin], [], [], wait)
+            except InterruptedError:
+                return
+            if not r:
+                return
+            data = os.read(self.fin, 4096)
+            if not data:
+                return
+            self.buf += data
+            wait = 0
+    def getch(self):
+        if self.keys:
+            return self.keys.popleft()
+        if not self.buf:
+            self.fill(None if self.to < 0 else self.to / 1000)
+        while self.buf:
+            k = self.parse()
+            if k is None:
+                n = len(self.buf)
+                self.fill(0.025)
+                if len(self.buf) == n:
+                    k = self.buf[0]
+                    self.buf = self.buf[1:]
+                    return k
+                continue
+            if k != -1:
+                return k
+        return -1
+    def parse(self):
+        b = self.buf
+        if b[0] == 0x1b:
+            if len(b) < 2:
+                return None
+            if b[1] in b'[O':
+                for e in range(2, len(b)):
+                    if 0x40 <= b[e] <= 0x7e:
+                        break
+                else:
+                    return None
+                seq = b[2:e].decode('latin-1')
+                fin = chr(b[e])
+                self.buf = b[e + 1:]
+                if seq.startswith('<') and fin in 'Mm':
+                    return self.mouse(seq[1:], fin)
+                return CSI_KEYS.get(seq + fin, CSI_KEYS.get(fin, -1) if not seq else -1)
+            self.buf = b[1:]
+            return 27
+        n = 1
+        if b[0] >= 0xf0:
+            n = 4
+        elif b[0] >= 0xe0:
+            n = 3
+        elif b[0] >= 0xc0:
+            n = 2
+        if len(b) < n:
+            return None
+        self.buf = b[n:]
+        c = b[:n].decode('utf-8', 'replace')
+        return 10 if c == '\r' else ord(c[0])
+    def mouse(self, seq, fin):
+        try:
+            bt, x, y = (int(v) for v in seq.split(';'))
+        except ValueError:
+            return -1
+        if bt & 64:
+            return -1
+        if bt & 32:
+            state = curses.REPORT_MOUSE_POSITION
+        elif bt & 3:
+            return -1
+        elif fin == 'M':
+            state = curses.BUTTON1_PRESSED
+        else:
+            state = curses.BUTTON1_RELEASED
+        self.mq.append((0, x - 1, y - 1, 0, state))
+        return curses.KEY_MOUSE
+class AnsiTerm(HTerm):
+    def init_pair(self, n, fg, bg):
+        self.scr.pairs[n] = (fg, bg)
+    def flushinp(self):
+        self.scr.buf = b''
+def ansi_main():
+    if termios is None:
+        sys.exit("--ansi needs a Unix terminal (termios is not available)")
+    scr = AnsiScr()
+    scr.start()
+    try:
+        app = App(scr, AnsiTerm(scr), journal=JOURNAL)
+        try:
+            app.run()
+        finally:
+            app.autosave.stop()
+            if app.jrn:
+                app.jrn.close()
+    finally:
+        scr.stop()
+def headless(w=80, h=24, keys=(), seed=None):
+    scr = HScr(w, h, keys)
+    return App(scr, HTerm(scr), seed=seed)
+def replay(fname, sess=-1, out=None):
+    hdr, evs = read_journal(fname)[sess]
+    if out:
+        out = os.path.abspath(out)
+    app = headless(hdr["w"], hdr["h"], seed=hdr["seed"])
+    frames = []
+    for rec in evs:
+        if not frames or frames[-1][0] != rec["f"]:
+            frames.append((rec["f"], [], []))
+        if "g" in rec:
+            frames[-1][1].append(rec["g"])
+        elif "k" in rec:
+            frames[-1][2].append(('k', rec["k"]))
+        else:
+            frames[-1][2].append(('m', tuple(rec["m"])))
+    rts = []
+    cwd = os.getcwd()
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        try:
+            for f, keys, q in frames:
+                app.scr.keys.extend(keys)
+                app.inq.extend(q)
+                app.pump(False)
+                t = time.perf_counter()
+                app.render()
+                rts.append(time.perf_counter() - t)
+                if not app.running:
+                    break
+        except EOFError:
+            pass
+        finally:
+            secs = time.perf_counter() - t0
+            app.autosave.stop()
+            os.chdir(cwd)
+    if out and not app.save_file(out):
+        raise OSError(f"could not save {out}")
+    rts.sort()
+    res = {
+        "events": sum(len(k) + len(q) for f, k, q in frames),
+        "frames": len(frames),
+        "secs": secs,
+        "recorded_secs": evs[-1]["t"] if evs else 0.0,
+        "render_p50_ms": rts[len(rts) // 2] * 1000 if rts else 0.0,
+        "render_p99_ms": rts[min(len(rts) - 1, len(rts) * 99 // 100)] * 1000 if rts else 0.0,
+    }
+    return app, res
+class App:
+    def __init__(self, scr, term=curses, journal=None, seed=None):
+        self.scr = scr
+        self.term = term
+        self.seed = random.randrange(1 << 32) if seed is None else seed
+        self.rng = random.Random(self.seed)
         self.h, self.w = scr.getmaxyx()
         self.cw = self.w - 2
         self.ch = self.h - 4
@@ -201,6 +2201,8 @@ class App:
         self.size = 1
         self.char = '#'
         self.thick = 1     
+        self.cap = "square"
+        self.fill_mode = 0
         self.col_names = [
             'default', 'blue', 'green', 'cyan', 'red', 'magenta', 'yellow', 'white',
             'black'
@@ -211,7 +2213,11 @@ class App:
         ]
         self.col = 0  
         self.bg_col = 0  
-        self.lyrs = [Lyr(self.cw, self.ch, "main")]
+        self.dmg = Dmg()
+        self.hist = Hist(50)
+        self.comp = Lyr(self.cw, self.ch, "comp")
+        self.recomp = True
+        self.lyrs = [self.new_lyr("main")]
         self.lyr = 0
         self.brs = [
             Brush(1, '#', 1, 0, "small"),     
@@ -233,49 +2239,73 @@ class App:
             Pat("arrow"),
             Pat("star")
         ]
+        user = load_pats(PATTERNS)
+        self.pats = [Pat(p.nm, user.pop(p.nm)) if p.nm in user else p for p in self.pats]
+        self.pats += [Pat(nm, st) for nm, st in user.items()]
         self.pat = 0
         self.shapes = [
             "line", "box", "circle", "arrow", "star", "triangle", "diamond", "heart"
         ]
         self.shape = 0
+        self.filled = False
+        self.vsel = None
         self.sx = None  
         self.sy = None  
         self.sel = None  
         self.clip = None  
-        self.undo_stack = deque(maxlen=50)
-        self.redo_stack = deque(maxlen=50)
         self.grid = False
-        self.help = False
         self.dirty = True
+        self.last_st = None
+        self.last_bt = None
+        self.last_ovl = None
+        self.last_view = None
+        self.ovl_cells = []
         self.running = True
         self.txt_mode = False
         self.txt_buf = ""
         self.txt_x = 0
         self.txt_y = 0
+        self.msg = ""
         self.mouse_down = False
+        self.inq = deque()
+        self.jrn = None
+        if journal:
+            try:
+                self.jrn = Journal(journal, self.seed, self.w, self.h)
+            except OSError:
+                self.jrn = None
         self.last_mx = 0
         self.last_my = 0
         self.drawing = False
+        self.stroke = False
         self.fps = 0
         self.last_t = time.time()
         self.frames = 0
+        self.bpf = None
+        self.last_out = 0
         self.stats = {
             'strokes': 0,     
             'saves': 0,       
             'undos': 0,       
             'tool_use': defaultdict(int),  
-            'start_time': time.time()      
+            'start_time': time.time(),
+            'wakeups': 0,
+            'idle_wakeups': 0
         }
+        self.next_frame = 0.0
         self.exp = False        
         self.debug_info = False 
-        curses.curs_set(0)
+        self.prof = Prof()
+        self.prof_txt = ()
+        self.autosave = Autosave("drawing.autosave.dtb", AUTOSAVE_SECS, AUTOSAVE_EDITS)
+        self.term.curs_set(0)
         self.scr.nodelay(1)  
         self.scr.keypad(1)   
         self.ft = 16
         self.scr.timeout(self.ft)  
-        if curses.has_colors():
-            curses.start_color()
-            curses.use_default_colors()
+        if self.term.has_colors():
+            self.term.start_color()
+            self.term.use_default_colors()
             pair_id = 1
             fc = len(self.col_names)
             bc = len(self.bg_names)
@@ -291,25 +2321,33 @@ class App:
                         fg_val = ic(fg)
                         bg_val = ic(bg)
                         try:
-                            curses.init_pair(pair_id, fg_val, bg_val)
+                            self.term.init_pair(pair_id, fg_val, bg_val)
                         except:
                             pass
                         pair_id += 1
-        try:
-            curses.mousemask(curses.ALL_MOUSE_EVENTS | curses.REPORT_MOUSE_POSITION)
-            curses.mouseinterval(0)
-            import sys
+        self.pairs = []
+        for i in range(len(self.col_names) * len(self.bg_names)):
             try:
-                sys.stdout.write("\033[?1006h\033[?1003h")
-                sys.stdout.flush()
-            except Exception:
-                pass
+                self.pairs.append(self.term.color_pair(i + 1))
+            except curses.error:
+                self.pairs.append(0)
+        try:
+            self.term.mousemask(curses.ALL_MOUSE_EVENTS | curses.REPORT_MOUSE_POSITION)
+            self.term.mouseinterval(0)
+            if term is curses:
+                try:
+                    sys.stdout.write("\033[?1006h\033[?1003h")
+                    sys.stdout.flush()
+                except Exception:
+                    pass
         except Exception:
             try:
-                curses.mousemask(curses.BUTTON1_PRESSED | curses.BUTTON1_RELEASED | curses.BUTTON1_CLICKED)
+                self.term.mousemask(curses.BUTTON1_PRESSED | curses.BUTTON1_RELEASED | curses.BUTTON1_CLICKED)
             except Exception:
                 pass
         self.sv()
+    def new_lyr(self, nm, vec=False):
+        return (VLyr(nm) if vec else TLyr(nm)).attach(self.dmg, self.hist)
     def get_lyr(self):
         if self.lyrs and 0 <= self.lyr < len(self.lyrs):
             return self.lyrs[self.lyr]
@@ -331,10 +2369,13 @@ class App:
         return self.zoom_pt(x, y)
     def hk(self, k):
         return self.handle_keyboard(k)
-    def hm(self, e):
-        return self.handle_mouse(e)
+    def hm(self, ev):
+        return self.handle_mouse(ev)
     def ht(self):
-        return self.handle_tool()
+        t = time.perf_counter()
+        r = self.handle_tool()
+        self.prof.add("tool", t)
+        return r
     def mt(self):
         return self.tool_menu()
     def mb(self):
@@ -380,51 +2421,71 @@ class App:
             y = (y // grid_size) * grid_size
         return x, y
     def zoom_pt(self, x, y):
-        zx = int((x - self.view_x) * self.zoom)
-        zy = int((y - self.view_y) * self.zoom)  
+        zx = math.ceil((x - self.view_x) * self.zoom)
+        zy = math.ceil((y - self.view_y) * self.zoom)  
         return zx, zy
+    def scr_pt(self, sx, sy):
+        return self.view_x + int(sx / self.zoom), self.view_y + int(sy / self.zoom)
+    def view_rect(self):
+        x2, y2 = self.scr_pt(self.cw - 1, self.ch - 1)
+        return self.view_x, self.view_y, x2, y2
     def get_real_pos(self):
-        real_x = int(self.cx / self.zoom + self.view_x)
-        real_y = int(self.cy / self.zoom + self.view_y)
+        return self.canvas_pt(self.cx, self.cy)
+    def canvas_pt(self, x, y):
+        real_x, real_y = self.scr_pt(x, y)
         if self.snap:
             real_x, real_y = self.snap_to_grid(real_x, real_y)
         return real_x, real_y
     def save_state(self):
-        state = []
-        for lyr in self.lyrs:
-            lyr_state = {
-                'data': [row[:] for row in lyr.d],
-                'cols': [row[:] for row in lyr.cols],
-                'bg_cols': [row[:] for row in lyr.bg_cols]
-            }
-            state.append(lyr_state)
-        self.undo_stack.append(state)
-        self.redo_stack.clear()
+        t = time.perf_counter()
+        if self.hist.commit():
+            self.autosave.edit()
+        self.prof.add("save", t)
+    def begin_stroke(self):
+        if not self.stroke:
+            self.stroke = True
+            self.hist.begin()
+    def commit_stroke(self):
+        if self.stroke:
+            self.stroke = False
+            if self.hist.end():
+                self.autosave.edit()
+    def apply_ops(self, ops, k):
+        for op in (reversed(ops) if k == 0 else ops):
+            kind = op[0]
+            if kind == 'cells':
+                op[1].apply(op[2], k)
+                continue
+            if kind == 'snap':
+                op[1].restore(op[2 + k])
+                continue
+            if kind == 'vec':
+                op[1].swap(op[3 - k], op[2 + k])
+                continue
+            if (kind == 'add') == (k == 0):
+                if op[2] in self.lyrs:
+                    self.lyrs.remove(op[2])
+            else:
+                self.lyrs.insert(min(op[1], len(self.lyrs)), op[2])
+            self.lyr = max(0, min(self.lyr, len(self.lyrs) - 1))
+            self.recomp = True
     def undo(self):
-        if len(self.undo_stack) > 1:  
-            self.redo_stack.append(self.undo_stack.pop())
-            state = self.undo_stack[-1]
-            for i, lyr_state in enumerate(state):
-                if i < len(self.lyrs):
-                    self.lyrs[i].d = [row[:] for row in lyr_state['data']]
-                    if 'cols' in lyr_state:
-                        self.lyrs[i].cols = [row[:] for row in lyr_state['cols']]
-                    if 'bg_cols' in lyr_state:
-                        self.lyrs[i].bg_cols = [row[:] for row in lyr_state['bg_cols']]
+        self.commit_stroke()
+        self.hist.commit()
+        if self.hist.undo:
+            ops = self.hist.undo.pop()
+            self.hist.redo.append(ops)
+            self.apply_ops(ops, 0)
+            self.autosave.edit()
             self.stats['undos'] += 1
-            self.dirty = True
     def redo(self):
-        if self.redo_stack:
-            state = self.redo_stack.pop()
-            self.undo_stack.append(state)
-            for i, lyr_state in enumerate(state):
-                if i < len(self.lyrs):
-                    self.lyrs[i].d = [row[:] for row in lyr_state['data']]
-                    if 'cols' in lyr_state:
-                        self.lyrs[i].cols = [row[:] for row in lyr_state['cols']]
-                    if 'bg_cols' in lyr_state:
-                        self.lyrs[i].bg_cols = [row[:] for row in lyr_state['bg_cols']]
-            self.dirty = True
+        self.commit_stroke()
+        self.hist.commit()
+        if self.hist.redo:
+            ops = self.hist.redo.pop()
+            self.hist.undo.append(ops)
+            self.apply_ops(ops, 1)
+            self.autosave.edit()
     def draw_pt(self, x, y, c=None, col=None, bg=None):
         lyr = self.get_lyr()
         if lyr:
@@ -436,46 +2497,18 @@ class App:
                 bg = self.bg_col
             lyr.set(x, y, c, col, bg)
     def draw_line(self, x1, y1, x2, y2):
-        dx = abs(x2 - x1)
-        dy = abs(y2 - y1)
-        if x1 < x2:
-            sx = 1
-        else:
-            sx = -1
-        if y1 < y2:
-            sy = 1
-        else:
-            sy = -1
-        err = dx - dy
-        x = x1
-        y = y1
-        while True:
-            if self.thick == 1:
-                self.draw_pt(x, y)
-            else:
-                for tx in range(self.thick):
-                    for ty in range(self.thick):
-                        offset_x = tx - self.thick // 2
-                        offset_y = ty - self.thick // 2
-                        self.draw_pt(x + offset_x, y + offset_y)
-            if x == x2 and y == y2:
-                break
-            e2 = 2 * err
-            if e2 > -dy:
-                err = err - dy
-                x = x + sx
-            if e2 < dx:
-                err = err + dx
-                y = y + sy
+        self.draw_polyline([(x1, y1), (x2, y2)])
+    def draw_polyline(self, pts):
+        self.draw_spans(0, 0, stroke_spans(pts, self.thick, self.cap))
     def draw_rect(self, x1, y1, x2, y2, fill=False):
         if x1 > x2:
             x1, x2 = x2, x1
         if y1 > y2:
             y1, y2 = y2, y1
         if fill:
-            for y in range(y1, y2 + 1):
-                for x in range(x1, x2 + 1):
-                    self.draw_pt(x, y)
+            lyr = self.get_lyr()
+            if lyr:
+                lyr.fill_rect(x1, y1, x2, y2, self.char, self.col, self.bg_col)
         else:
             for x in range(x1, x2 + 1):
                 self.draw_pt(x, y1)  
@@ -483,86 +2516,53 @@ class App:
             for y in range(y1, y2 + 1):
                 self.draw_pt(x1, y)  
                 self.draw_pt(x2, y)  
+    def draw_spans(self, cx, cy, spans):
+        lyr = self.get_lyr()
+        if lyr:
+            for dy, a, b in spans:
+                lyr.fill_rect(cx + a, cy + dy, cx + b, cy + dy, self.char, self.col, self.bg_col)
     def draw_circ(self, cx, cy, r, fill=False):
         if fill:
-            for y in range(cy - r, cy + r + 1):
-                for x in range(cx - r, cx + r + 1):
-                    if (x - cx)**2 + (y - cy)**2 <= r**2:
-                        self.draw_pt(x, y)
+            self.draw_spans(cx, cy, ellipse_spans(r, r))
         else:
-            x, y = 0, r
-            d = 3 - 2 * r
-            self._draw_circ_pts(cx, cy, x, y)
-            while y >= x:
-                x += 1
-                if d > 0:
-                    y -= 1
-                    d = d + 4 * (x - y) + 10
-                else:
-                    d = d + 4 * x + 6
-                self._draw_circ_pts(cx, cy, x, y)
-    def _draw_circ_pts(self, cx, cy, x, y):
-        pts = [(cx+x, cy+y), (cx-x, cy+y), (cx+x, cy-y), (cx-x, cy-y),
-               (cx+y, cy+x), (cx-y, cy+x), (cx+y, cy-x), (cx-y, cy-x)]
-        for px, py in pts:
-            self.draw_pt(px, py)
+            for x, y in circle_pts(r):
+                self.draw_pt(cx + x, cy + y)
+    def draw_poly(self, shape, cx, cy, r, fill=False):
+        if fill:
+            self.draw_spans(cx, cy, poly_spans(shape, r))
+            return
+        vs = [(cx + x, cy + y) for x, y in poly_verts(shape, r)]
+        self.draw_polyline(vs + vs[:1])
     def draw_arrow(self, x1, y1, x2, y2):
-        self.draw_line(x1, y1, x2, y2)
-        dx = x2 - x1
-        dy = y2 - y1
-        length = math.sqrt(dx*dx + dy*dy)
-        if length > 2:  
-            dx = dx / length
-            dy = dy / length
-            head_len = max(3, int(length * 0.3))  
-            if head_len > 8:
-                head_len = 8  
-            angle = 0.6  
-            perp_x = -dy
-            perp_y = dx
-            ax1 = x2 - head_len * dx + head_len * 0.4 * perp_x
-            ay1 = y2 - head_len * dy + head_len * 0.4 * perp_y
-            ax2 = x2 - head_len * dx - head_len * 0.4 * perp_x
-            ay2 = y2 - head_len * dy - head_len * 0.4 * perp_y
-            self.draw_line(x2, y2, int(ax1), int(ay1))
-            self.draw_line(x2, y2, int(ax2), int(ay2))
-    def draw_star(self, cx, cy, r):
-        pts = []
-        inner_r = r * 0.38  
-        for i in range(10):  
-            angle = i * math.pi / 5 - math.pi/2  
-            if i % 2 == 0:
-                x = cx + int(r * math.cos(angle))
-                y = cy + int(r * math.sin(angle) * 0.6)  
-            else:
-                x = cx + int(inner_r * math.cos(angle))
-                y = cy + int(inner_r * math.sin(angle) * 0.6)  
-            pts.append((x, y))
-        for i in range(10):
-            next_i = (i + 1) % 10
-            self.draw_line(pts[i][0], pts[i][1], pts[next_i][0], pts[next_i][1])
-    def draw_triangle(self, cx, cy, r):
-        pts = []
-        v_scale = 0.7  
-        for i in range(3):
-            angle = i * 2 * math.pi / 3 - math.pi/2  
-            x = cx + int(r * math.cos(angle))
-            y = cy + int(r * math.sin(angle) * v_scale)
-            pts.append((x, y))
-        for i in range(3):
-            next_i = (i + 1) % 3
-            self.draw_line(pts[i][0], pts[i][1], pts[next_i][0], pts[next_i][1])
-    def draw_hex(self, cx, cy, r):
-        pts = []
-        v_scale = 0.65  
-        for i in range(6):
-            angle = i * math.pi / 3 + math.pi/6  
-            x = cx + int(r * math.cos(angle))
-            y = cy + int(r * math.sin(angle) * v_scale)  
-            pts.append((x, y))
-        for i in range(6):
-            next_i = (i + 1) % 6
-            self.draw_line(pts[i][0], pts[i][1], pts[next_i][0], pts[next_i][1])
+        for a, b in arrow_segs(x1, y1, x2, y2):
+            self.draw_line(*a, *b)
+    def add_shape(self, tool, x1, y1, x2, y2):
+        fill = self.filled and tool not in ("line", "arrow")
+        self.get_lyr().add(VShape(tool, (x1, y1, x2, y2), fill, self.char, self.col, self.bg_col, self.thick, self.cap))
+    def move_shape(self, x, y):
+        lyr = self.get_lyr()
+        if self.sx is None:
+            s = lyr.hit(x, y)
+            if s is not None:
+                self.vsel = s.id
+                self.sx, self.sy = x, y
+        else:
+            s = lyr.shapes.get(self.vsel)
+            if s is not None:
+                lyr.put(s, s.moved(x - self.sx, y - self.sy))
+                self.save_state()
+            self.vsel = None
+            self.sx, self.sy = None, None
+    def draw_star(self, cx, cy, r, fill=False):
+        self.draw_poly("star", cx, cy, r, fill)
+    def draw_triangle(self, cx, cy, r, fill=False):
+        self.draw_poly("tri", cx, cy, r, fill)
+    def draw_hex(self, cx, cy, r, fill=False):
+        self.draw_poly("hex", cx, cy, r, fill)
+    def draw_diamond(self, cx, cy, r, fill=False):
+        self.draw_poly("dia", cx, cy, r, fill)
+    def draw_heart(self, cx, cy, r, fill=False):
+        self.draw_poly("heart", cx, cy, r, fill)
     def flood_fill(self, x, y, new_c=None, new_col=None, new_bg=None):
         lyr = self.get_lyr()
         if not lyr:
@@ -573,25 +2573,12 @@ class App:
             new_col = self.col
         if new_bg is None:
             new_bg = self.bg_col
-        old_c = lyr.get(x, y)
-        old_col = lyr.get_col(x, y)
-        if old_c == new_c and old_col == new_col:
-            return
-        stack = [(x, y)]
-        while stack:
-            cx, cy = stack.pop()
-            if lyr.get(cx, cy) != old_c or lyr.get_col(cx, cy) != old_col:
-                continue
-            lyr.set(cx, cy, new_c, new_col, new_bg)
-            for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
-                nx, ny = cx + dx, cy + dy
-                if 0 <= nx < lyr.w and 0 <= ny < lyr.h:
-                    if lyr.get(nx, ny) == old_c and lyr.get_col(nx, ny) == old_col:
-                        stack.append((nx, ny))
+        nm, conn8, glyph, same_bg = FILL_MODES[self.fill_mode]
+        scan_fill(lyr, x, y, self.view_rect(), new_c, new_col, new_bg, conn8, glyph, same_bg)
     def spray_paint(self, x, y):
         for _ in range(self.size * 3):
-            dx = random.randint(-self.size*2, self.size*2)
-            dy = random.randint(-self.size*2, self.size*2) 
+            dx = self.rng.randint(-self.size*2, self.size*2)
+            dy = self.rng.randint(-self.size*2, self.size*2) 
             if dx*dx + dy*dy <= (self.size*2)**2:
                 self.draw_pt(x + dx, y + dy)
     def use_brush(self, x, y):
@@ -600,16 +2587,30 @@ class App:
     def use_pat(self, x, y):
         pat = self.pats[self.pat]
         pat.apply(self.get_lyr(), x, y, self.col, self.bg_col)
+    def tile_pat(self):
+        lyr = self.get_lyr()
+        if not lyr:
+            return
+        if isinstance(lyr, VLyr):
+            self.msg = "Patterns draw cells; switch to a raster layer"
+            return
+        x1, y1, x2, y2 = self.sel if self.sel else self.view_rect()
+        self.pats[self.pat].tile(lyr, x1, y1, x2, y2, self.col, self.bg_col)
+        self.save_state()
     def handle_tool(self):
         tool = self.tools[self.tool]
+        x, y = self.rp()
         self.stats['tool_use'][tool] += 1
         if DEBUG:
             try:
-                self.scr.addstr(self.h - 3, 0, f"Using tool: {tool} at {self.cx},{self.cy}", curses.A_DIM)
+                self.scr.addstr(self.h - 3, 0, f"Using tool: {tool} at {x},{y}", curses.A_DIM)
             except curses.error:
                 pass
+        if tool in RASTER_TOOLS and isinstance(self.get_lyr(), VLyr):
+            self.msg = f"{tool} draws cells; switch to a raster layer"
+            return
         if tool == "pen":
-            self.use_brush(self.cx, self.cy)
+            self.use_brush(x, y)
             self.stats['strokes'] += 1
             self.save_state()
         elif tool == "ers":
@@ -619,134 +2620,190 @@ class App:
             self.char = ' '
             self.col = 0
             self.bg_col = 0
-            self.use_brush(self.cx, self.cy)
+            self.use_brush(x, y)
             self.char = old_char
             self.col = old_col
             self.bg_col = old_bg
             self.save_state()
+        elif tool in SHAPE_TOOLS and self.sx is not None and isinstance(self.get_lyr(), VLyr):
+            self.add_shape(tool, self.sx, self.sy, x, y)
+            self.sx, self.sy = None, None
+            self.save_state()
+        elif tool == "move" and isinstance(self.get_lyr(), VLyr):
+            self.move_shape(x, y)
         elif tool == "line":
             if self.sx is None:
-                self.sx, self.sy = self.cx, self.cy
+                self.sx, self.sy = x, y
             else:
-                self.draw_line(self.sx, self.sy, self.cx, self.cy)
+                self.draw_line(self.sx, self.sy, x, y)
                 self.sx, self.sy = None, None
                 self.save_state()
         elif tool == "box":
             if self.sx is None:
-                self.sx, self.sy = self.cx, self.cy
+                self.sx, self.sy = x, y
             else:
-                self.draw_rect(self.sx, self.sy, self.cx, self.cy)
+                self.draw_rect(self.sx, self.sy, x, y, self.filled)
                 self.sx, self.sy = None, None
                 self.save_state()
         elif tool == "circ":
             if self.sx is None:
-                self.sx, self.sy = self.cx, self.cy
+                self.sx, self.sy = x, y
             else:
-                r = int(math.sqrt((self.cx - self.sx)**2 + (self.cy - self.sy)**2))
-                self.draw_circ(self.sx, self.sy, r)
+                r = int(math.sqrt((x - self.sx)**2 + (y - self.sy)**2))
+                self.draw_circ(self.sx, self.sy, r, self.filled)
                 self.sx, self.sy = None, None
                 self.save_state()
         elif tool == "fill":
-            self.flood_fill(self.cx, self.cy)
+            self.flood_fill(x, y)
             self.save_state()
         elif tool == "spray":
-            self.spray_paint(self.cx, self.cy)
+            self.spray_paint(x, y)
             self.stats['strokes'] += 1
             self.save_state()
         elif tool == "text":
             self.txt_mode = True
             self.txt_buf = ""
-            self.txt_x, self.txt_y = self.cx, self.cy
+            self.txt_x, self.txt_y = x, y
         elif tool == "sel":
             if self.sx is None:
-                self.sx, self.sy = self.cx, self.cy
+                self.sx, self.sy = x, y
             else:
-                x1, y1 = min(self.sx, self.cx), min(self.sy, self.cy)
-                x2, y2 = max(self.sx, self.cx), max(self.sy, self.cy)
+                x1, y1 = min(self.sx, x), min(self.sy, y)
+                x2, y2 = max(self.sx, x), max(self.sy, y)
                 self.sel = (x1, y1, x2, y2)
                 self.sx, self.sy = None, None
         elif tool == "move":
-            if self.sel and self.clip:
-                self.paste_clip(self.cx, self.cy)
+            if self.sel:
+                lift = not self.clip
+                if lift:
+                    self.copy_sel(cut=True)
+                self.paste_clip(x, y)
+                if lift:
+                    self.clip = None
                 self.save_state()
         elif tool == "copy":
             if self.sel:
                 self.copy_sel()
         elif tool == "pat":
-            self.use_pat(self.cx, self.cy)
+            self.use_pat(x, y)
             self.save_state()
         elif tool == "arrow":
             if self.sx is None:
-                self.sx, self.sy = self.cx, self.cy
+                self.sx, self.sy = x, y
             else:
-                self.draw_arrow(self.sx, self.sy, self.cx, self.cy)
+                self.draw_arrow(self.sx, self.sy, x, y)
                 self.sx, self.sy = None, None
                 self.save_state()
         elif tool == "star":
             if self.sx is None:
-                self.sx, self.sy = self.cx, self.cy
+                self.sx, self.sy = x, y
             else:
-                r = int(math.sqrt((self.cx - self.sx)**2 + (self.cy - self.sy)**2))
+                r = int(math.sqrt((x - self.sx)**2 + (y - self.sy)**2))
                 if r < 3:
                     r = 3
-                self.draw_star(self.sx, self.sy, r)
+                self.draw_star(self.sx, self.sy, r, self.filled)
                 self.sx, self.sy = None, None
                 self.save_state()
         elif tool == "tri":
             if self.sx is None:
-                self.sx, self.sy = self.cx, self.cy
+                self.sx, self.sy = x, y
             else:
-                r = int(math.sqrt((self.cx - self.sx)**2 + (self.cy - self.sy)**2))
+                r = int(math.sqrt((x - self.sx)**2 + (y - self.sy)**2))
                 if r < 3:
                     r = 3
-                self.draw_triangle(self.sx, self.sy, r)
+                self.draw_triangle(self.sx, self.sy, r, self.filled)
                 self.sx, self.sy = None, None
                 self.save_state()
         elif tool == "hex":
             if self.sx is None:
-                self.sx, self.sy = self.cx, self.cy
+                self.sx, self.sy = x, y
+            else:
+                r = int(math.sqrt((x - self.sx)**2 + (y - self.sy)**2))
+                if r < 3:
+                    r = 3
+                self.draw_hex(self.sx, self.sy, r, self.filled)
+                self.sx, self.sy = None, None
+                self.save_state()
+        elif tool == "dia":
+            if self.sx is None:
+                self.sx, self.sy = x, y
             else:
-                r = int(math.sqrt((self.cx - self.sx)**2 + (self.cy - self.sy)**2))
+                r = int(math.sqrt((x - self.sx)**2 + (y - self.sy)**2))
                 if r < 3:
                     r = 3
-                self.draw_hex(self.sx, self.sy, r)
+                self.draw_diamond(self.sx, self.sy, r, self.filled)
                 self.sx, self.sy = None, None
                 self.save_state()
-    def copy_sel(self):
+        elif tool == "heart":
+            if self.sx is None:
+                self.sx, self.sy = x, y
+            else:
+                r = int(math.sqrt((x - self.sx)**2 + (y - self.sy)**2))
+                if r < 3:
+                    r = 3
+                self.draw_heart(self.sx, self.sy, r, self.filled)
+                self.sx, self.sy = None, None
+                self.save_state()
+    def copy_sel(self, all_lyrs=False, cut=False):
         if not self.sel:
             return
         x1, y1, x2, y2 = self.sel
-        lyr = self.get_lyr()
-        if not lyr:
+        if all_lyrs:
+            lyrs = [(lyr, lyr) for lyr in self.lyrs if lyr.vis and not isinstance(lyr, VLyr)]
+        elif isinstance(self.get_lyr(), VLyr):
+            self.msg = "Copy/cut works on raster layers; use the move tool for shapes"
             return
-        self.clip = []
-        for y in range(y1, y2 + 1):
-            row = []
-            for x in range(x1, x2 + 1):
-                ch = lyr.get(x, y)
-                col = lyr.get_col(x, y)
-                bg = lyr.get_bg(x, y)
-                row.append((ch, col, bg))
-            self.clip.append(row)
+        elif self.get_lyr():
+            lyrs = [(None, self.get_lyr())]
+        else:
+            return
+        parts = [(dst, grab(lyr, x1, y1, x2, y2)) for dst, lyr in lyrs]
+        self.clip = Clip(x2 - x1 + 1, y2 - y1 + 1, parts)
+        if cut:
+            for (dst, lyr), (_, runs) in zip(lyrs, parts):
+                for dy, dx, chs, fgs, bgs in runs:
+                    lyr.fill_rect(x1 + dx, y1 + dy, x1 + dx + len(chs) - 1, y1 + dy, ' ', 0, 0)
     def paste_clip(self, x, y):
         if not self.clip:
             return
-        lyr = self.get_lyr()
-        if not lyr:
+        if isinstance(self.get_lyr(), VLyr) and any(dst is None for dst, runs in self.clip.parts):
+            self.msg = "Paste needs a raster layer"
             return
-        for dy, row in enumerate(self.clip):
-            for dx, (ch, col, bg) in enumerate(row):
-                if ch != ' ':
-                    lyr.set(x + dx, y + dy, ch, col, bg)
-    def add_lyr(self):
-        new_lyr = Lyr(self.cw, self.ch, f"layer{len(self.lyrs)+1}")
+        for dst, runs in self.clip.parts:
+            lyr = self.get_lyr() if dst is None else dst
+            if not lyr or not any(l is lyr for l in self.lyrs):
+                continue
+            for dy, dx, chs, fgs, bgs in runs:
+                lyr.put_span(x + dx, y + dy, chs, fgs, bgs)
+        self.sel = (x, y, x + self.clip.w - 1, y + self.clip.h - 1)
+    def xform_clip(self, k):
+        if not self.clip:
+            return
+        if k == ord('|'):
+            self.clip = self.clip.flip_h()
+        elif k == ord('^'):
+            self.clip = self.clip.flip_v()
+        elif k == ord('@'):
+            self.clip = self.clip.rot90()
+        elif k == ord('}'):
+            self.clip = self.clip.scale(2.0)
+        elif k == ord('{'):
+            self.clip = self.clip.scale(0.5)
+        if self.sel:
+            x1, y1 = self.sel[:2]
+            self.sel = (x1, y1, x1 + self.clip.w - 1, y1 + self.clip.h - 1)
+    def add_lyr(self, vec=False):
+        new_lyr = self.new_lyr(f"{'vector' if vec else 'layer'}{len(self.lyrs)+1}", vec)
         self.lyrs.append(new_lyr)
         self.lyr = len(self.lyrs) - 1
+        self.hist.ops.append(('add', self.lyr, new_lyr))
         self.save_state()
     def del_lyr(self):
         if len(self.lyrs) > 1:
+            self.hist.ops.append(('del', self.lyr, self.lyrs[self.lyr]))
             del self.lyrs[self.lyr]
             self.lyr = min(self.lyr, len(self.lyrs) - 1)
+            self.recomp = True
             self.save_state()
     def clr_canvas(self):
         for lyr in self.lyrs:
@@ -770,15 +2827,15 @@ class App:
             self.scr.addstr(0, 0, "Clear All? Y/N")
         self.scr.refresh()
         try:
-            curses.flushinp()  
+            self.term.flushinp()  
             self.scr.nodelay(0)
             self.scr.timeout(-1)
-            k = self.scr.getch()
+            k = self.getk()
             if k == ord('Y') or k == ord('y'):
-                self.lyrs = [Lyr(self.cw, self.ch, "main")]
+                self.lyrs = [self.new_lyr("main")]
                 self.lyr = 0
-                self.undo_stack.clear()
-                self.redo_stack.clear()
+                self.recomp = True
+                self.hist.clear()
                 self.clip = None
                 self.sel = None
                 self.view_x = 0
@@ -809,51 +2866,33 @@ class App:
                 except:
                     self.scr.addstr(0, 0, "Cleared!")
                 self.scr.refresh()
-                self.scr.getch()
+                self.getk()
         finally:
             self.scr.nodelay(1)
             self.scr.timeout(self.ft)
         self.dirty = True
+    def doc_box(self):
+        x1, y1, x2, y2 = extent(self.lyrs, [0, 0, self.cw - 1, self.ch - 1])
+        return x2 - x1 + 1, y2 - y1 + 1, (x1, y1)
     def save_file(self, fname="drawing.json"):
-        data = {
-            'width': self.cw,
-            'height': self.ch,
-            'layers': []
-        }
-        for lyr in self.lyrs:
-            lyr_data = {
-                'name': lyr.nm,
-                'visible': lyr.vis,
-                'data': lyr.d,
-                'colors': lyr.cols,
-                'bg_colors': lyr.bg_cols
-            }
-            data['layers'].append(lyr_data)
         try:
-            with open(fname, 'w') as f:
-                json.dump(data, f)
+            w, h, org = self.doc_box()
+            write_drawing(fname, w, h, self.lyrs, org=org)
             self.stats['saves'] += 1
             return True
         except:
             return False
+    def save_bg(self, fname="drawing.dtb"):
+        w, h, org = self.doc_box()
+        self.autosave.submit(fname, w, h, self.lyrs, org)
+        self.stats['saves'] += 1
     def load_file(self, fname):
         try:
-            with open(fname, 'r') as f:
-                data = json.load(f)
-            self.cw = data['width']
-            self.ch = data['height']
-            self.lyrs = []
-            for lyr_data in data['layers']:
-                lyr = Lyr(self.cw, self.ch, lyr_data['name'])
-                lyr.vis = lyr_data['visible']
-                lyr.d = lyr_data['data']
-                if 'colors' in lyr_data:
-                    lyr.cols = [[int(col) if isinstance(col, str) else col for col in row] for row in lyr_data['colors']]
-                if 'bg_colors' in lyr_data:
-                    lyr.bg_cols = [[int(col) if isinstance(col, str) else col for col in row] for row in lyr_data['bg_colors']]
-                self.lyrs.append(lyr)
+            w, h, lyrs, org = read_drawing(fname)
+            self.lyrs = [lyr.attach(self.dmg, self.hist) for lyr in lyrs]
             self.lyr = 0
-            self.save_state()
+            self.recomp = True
+            self.hist.clear()
             return True
         except:
             return False
@@ -895,7 +2934,7 @@ class App:
                 item = f"{i+1}. {tool_name}"
                 items.append(item)
             self.show_menu("TOOLS", items, self.tool)
-            k = self.scr.getch()
+            k = self.getk()
             if k == curses.KEY_UP or k == ord('w'):
                 self.tool = self.tool - 1
                 if self.tool < 0:
@@ -919,10 +2958,12 @@ class App:
             items = []
             for i in range(len(self.brs)):
                 br = self.brs[i]
-                item = f"{i+1}. {br.nm} ({br.sz})"
+                item = f"{i+1}. {br.nm} ({br.sz}) {br.shape}"
+                if br.shape == "soft":
+                    item += f" {int(br.density * 100)}%"
                 items.append(item)
             self.show_menu("BRUSHES", items, self.br)
-            k = self.scr.getch()
+            k = self.getk()
             if k == curses.KEY_UP or k == ord('w'):
                 self.br = self.br - 1
                 if self.br < 0:
@@ -931,6 +2972,15 @@ class App:
                 self.br = self.br + 1
                 if self.br >= len(self.brs):
                     self.br = 0
+            elif k == ord('c'):
+                br = self.brs[self.br]
+                br.shape = SHAPES[(SHAPES.index(br.shape) + 1) % len(SHAPES)]
+            elif k == ord('-'):
+                br = self.brs[self.br]
+                br.density = max(0.25, br.density - 0.25)
+            elif k == ord('+'):
+                br = self.brs[self.br]
+                br.density = min(1.0, br.density + 0.25)
             elif k == ord('\n') or k == ord(' '):
                 break
             elif k == 27:
@@ -951,7 +3001,7 @@ class App:
             bg_name = self.bg_names[self.bg_col]
             items.append("BG: " + bg_name)
             self.show_menu("COLORS (↑/↓ FG, SHIFT+↑/↓ BG)", items, self.col)
-            k = self.scr.getch()
+            k = self.getk()
             if k == curses.KEY_UP or k == ord('w'):
                 self.col = self.col - 1
                 if self.col < 0:
@@ -985,7 +3035,7 @@ class App:
         while True:
             items = [pat.nm for pat in self.pats]
             self.show_menu("PATTERNS", items, self.pat)
-            k = self.scr.getch()
+            k = self.getk()
             if k == curses.KEY_UP:
                 self.pat = (self.pat - 1) % len(self.pats)
             elif k == curses.KEY_DOWN:
@@ -1001,9 +3051,14 @@ class App:
             for i, lyr in enumerate(self.lyrs):
                 vis = "+" if lyr.vis else "-"
                 lock = "L" if lyr.lock else " "
-                items.append(f"{vis}{lock} {lyr.nm}")
+                alpha = f" {int(lyr.alpha * 100)}%" if lyr.alpha < 1.0 else ""
+                n, rows = lyr.stats()
+                box = lyr.bbox()
+                size = f" {box[2] - box[0] + 1}x{box[3] - box[1] + 1}" if box else ""
+                occ = f"{n} shapes" if isinstance(lyr, VLyr) else f"{n} cells/{rows} rows"
+                items.append(f"{vis}{lock} {lyr.nm}{alpha} [{occ}{size}]")
             self.show_menu("LAYERS", items, self.lyr)
-            k = self.scr.getch()
+            k = self.getk()
             if k == curses.KEY_UP:
                 self.lyr = (self.lyr - 1) % len(self.lyrs)
             elif k == curses.KEY_DOWN:
@@ -1014,10 +3069,19 @@ class App:
                 break
             elif k == ord('v'):  
                 self.lyrs[self.lyr].vis = not self.lyrs[self.lyr].vis
+                self.recomp = True
             elif k == ord('l'):  
                 self.lyrs[self.lyr].lock = not self.lyrs[self.lyr].lock
+            elif k == ord('a'):
+                self.lyrs[self.lyr].alpha = max(0.25, self.lyrs[self.lyr].alpha - 0.25)
+                self.recomp = True
+            elif k == ord('A'):
+                self.lyrs[self.lyr].alpha = min(1.0, self.lyrs[self.lyr].alpha + 0.25)
+                self.recomp = True
             elif k == ord('+'):
                 self.add_lyr()
+            elif k == ord('V'):
+                self.add_lyr(True)
             elif k == ord('-'):
                 self.del_lyr()
         self.dirty = True
@@ -1032,8 +3096,9 @@ class App:
                     marker = " "
                 line = marker + " " + shape_name
                 items.append(line)
+            items.append(("[x]" if self.filled else "[ ]") + " filled (f)")
             self.show_menu("SHAPES", items, self.shape)
-            k = self.scr.getch()
+            k = self.getk()
             if k == curses.KEY_UP:
                 self.shape = self.shape - 1
                 if self.shape < 0:
@@ -1042,7 +3107,10 @@ class App:
                 self.shape = self.shape + 1  
                 if self.shape >= len(self.shapes):
                     self.shape = 0
+            elif k == ord('f'):
+                self.filled = not self.filled
             elif k == ord('\n') or k == ord(' '):
+                self.tool = self.tools.index(SHAPE_TOOL[self.shapes[self.shape]])
                 break
             elif k == 27:  
                 break
@@ -1057,12 +3125,13 @@ class App:
             "",
             "TOOLS:",
             "  SPACE - Use current tool",
-            "  TAB - Tool menu (16 tools)",
+            "  TAB - Tool menu (18 tools)",
             "  B - Brush menu", 
             "  P - Pattern menu (10 patterns)",
-            "  L - Layer menu",
+            "  T - Tile pattern across selection",
+            "  L - Layer menu (V: vector layer)",
             "  K - Color menu (9 colors)",
-            "  N - Shapes menu",
+            "  N - Shapes menu (f: filled)",
             "",
             "COLORS:",
             "  C - Cycle foreground color",
@@ -1072,8 +3141,13 @@ class App:
             "DRAWING:", 
             "  1-5 - Brush size & character",
             "  [ ] - Decrease/increase thickness",
+            "  \\ - Square/round line caps",
             "  G - Toggle grid display",
             "  F - Toggle grid snap",
+            "  M - Cycle fill mode (4/8-way, glyph, bg)",
+            "  Y - Copy selection, SHIFT+Y - all layers",
+            "  SHIFT+Z - Cut selection",
+            "  | ^ - Flip clipboard, @ - rotate, { } - scale",
             "  U - Undo",
             "  R - Redo",
             "  X - Clear canvas",
@@ -1088,16 +3162,18 @@ class App:
             "SHAPES:",
             "  Arrow, Star, Triangle, Hexagon",
             "  Click start, click end",
+            "  Vector layer: move tool drags shapes",
             "",
             "FILES:",
             "  S - Save drawing",
             "  O - Open drawing",
             "",
+            "~ - Profiler overlay, E - dump trace",
             "H - Toggle this help",
             "Q - Quit",
             "",
             "New: Grid snap, zoom, 10 patterns,",
-            "16 tools, shapes library!",
+            "18 tools, filled shapes!",
             "",
             "Press any key to close..."
         ]
@@ -1107,177 +3183,414 @@ class App:
                 self.scr.addstr(i, 2, line)
         self.scr.refresh()
         try:
-            curses.flushinp()  
+            self.term.flushinp()  
             self.scr.nodelay(0)
             self.scr.timeout(-1)
-            self.scr.getch()
+            self.getk()
         finally:
             self.scr.nodelay(1)
             self.scr.timeout(self.ft)
         self.dirty = True
-    def handle_mouse(self, event):
-        try:
-            id, x, y, z, state = curses.getmouse()
-            cx = x
-            cy = y - 1  
-            if 0 <= cx < self.cw and 0 <= cy < self.ch:
-                self.cx = cx
-                self.cy = cy
-                moved = (cx != self.last_mx or cy != self.last_my)
-                if self.mouse_down and self.drawing and moved:
-                    self.draw_line(self.last_mx, self.last_my, cx, cy)
-                    self.last_mx = cx
-                    self.last_my = cy
-                if state & curses.BUTTON1_RELEASED:
-                    if self.mouse_down:
-                        if self.drawing and (cx != self.last_mx or cy != self.last_my):
-                            self.draw_line(self.last_mx, self.last_my, cx, cy)
-                        if self.drawing or self.tools[self.tool] not in ["pen", "ers"]:
-                            self.sv()
-                    self.mouse_down = False
-                    self.drawing = False
-                elif (state & curses.BUTTON1_PRESSED) and not self.mouse_down:
-                    self.mouse_down = True
-                    self.drawing = False
-                    self.last_mx = cx
-                    self.last_my = cy
-                    if self.tools[self.tool] in ["pen", "ers"]:
-                        self.ht()  
-                        self.drawing = True
-                    elif self.tools[self.tool] in ["line", "box", "circ", "arrow", "star", "tri", "hex"]:
-                        if self.sx is None:
-                            self.sx, self.sy = cx, cy
-                        else:
-                            self.ht()
-                            self.sv()
+    def mouse_path(self, pts):
+        if not (self.mouse_down and self.drawing):
+            return
+        path = [(self.last_mx, self.last_my)]
+        for x, y in pts:
+            if not (0 <= x < self.cw and 0 <= y - 1 < self.ch):
+                continue
+            p = self.canvas_pt(x, y - 1)
+            if p == path[-1]:
+                continue
+            if len(path) > 1:
+                (ax, ay), (bx, by) = path[-2], path[-1]
+                ux, uy, vx, vy = bx - ax, by - ay, p[0] - bx, p[1] - by
+                if ux * vy == uy * vx and ux * vx + uy * vy > 0:
+                    path[-1] = p
+                    continue
+            path.append(p)
+        if len(path) > 1:
+            self.draw_polyline(path)
+        self.last_mx, self.last_my = path[-1]
+    def handle_mouse(self, ev):
+        id, x, y, z, state = ev
+        cx = x
+        cy = y - 1  
+        if 0 <= cx < self.cw and 0 <= cy < self.ch:
+            self.cx = cx
+            self.cy = cy
+            cx, cy = self.rp()
+            moved = (cx != self.last_mx or cy != self.last_my)
+            if self.mouse_down and self.drawing and moved:
+                self.draw_line(self.last_mx, self.last_my, cx, cy)
+                self.last_mx = cx
+                self.last_my = cy
+            if state & curses.BUTTON1_RELEASED:
+                if self.mouse_down:
+                    if self.drawing and (cx != self.last_mx or cy != self.last_my):
+                        self.draw_line(self.last_mx, self.last_my, cx, cy)
+                    if self.drawing:
+                        self.commit_stroke()
+                    elif self.tools[self.tool] not in ["pen", "ers"]:
+                        self.sv()
+                self.mouse_down = False
+                self.drawing = False
+            elif (state & curses.BUTTON1_PRESSED) and not self.mouse_down:
+                self.mouse_down = True
+                self.drawing = False
+                self.last_mx = cx
+                self.last_my = cy
+                if self.tools[self.tool] in ["pen", "ers"]:
+                    self.begin_stroke()
+                    self.ht()  
+                    self.drawing = not isinstance(self.get_lyr(), VLyr)
+                elif self.tools[self.tool] in SHAPE_TOOLS:
+                    if self.sx is None:
+                        self.sx, self.sy = cx, cy
                     else:
                         self.ht()
                         self.sv()
-                elif (state & curses.BUTTON1_CLICKED) and not self.mouse_down:
+                else:
                     self.ht()
                     self.sv()
-                self.dirty = True
-        except curses.error:
-            pass
+            elif (state & curses.BUTTON1_CLICKED) and not self.mouse_down:
+                self.ht()
+                self.sv()
+        elif state & curses.BUTTON1_RELEASED:
+            self.commit_stroke()
+            self.mouse_down = False
+            self.drawing = False
+    def read_input(self, wait=0):
+        blocked = got = False
+        t = None
+        while not self.inq or self.inq[-1][0] == 'm' or self.inq[-1][1] in MOVES:
+            self.scr.timeout(-1 if wait is None else wait)
+            blocked = blocked or wait != 0
+            wait = 0
+            try:
+                k = self.scr.getch()
+            except curses.error:
+                break
+            if t is None:
+                t = time.perf_counter()
+            if k == -1 or k == curses.ERR:
+                break
+            got = True
+            if k == curses.KEY_MOUSE:
+                try:
+                    self.inq.append(('m', self.term.getmouse()))
+                except curses.error:
+                    pass
+            else:
+                self.inq.append(('k', k))
+        if got:
+            self.prof.add("input", t)
+        return blocked, got
+    def pop(self):
+        kind, v = self.inq.popleft()
+        if self.jrn:
+            self.jrn.ev(kind, v)
+        return kind, v
+    def getk(self):
+        self.scr.timeout(-1)
+        k = self.scr.getch()
+        if self.jrn and k != -1:
+            self.jrn.ev('g', k)
+        return k
+    def pump(self, cap=True):
+        q = self.inq
+        if self.jrn and q:
+            self.jrn.frame += 1
+        t = time.perf_counter()
+        n = 0
+        while q and (not cap or n < INPUT_MAX and time.perf_counter() - t < INPUT_MS / 1000):
+            kind, v = self.pop()
+            n += 1
+            if kind == 'm':
+                if not v[4] & BTN:
+                    pts = []
+                    while q and q[0][0] == 'm' and not q[0][1][4] & BTN:
+                        pts.append(v[1:3])
+                        v = self.pop()[1]
+                        n += 1
+                    pts.append(v[1:3])
+                    self.mouse_path(pts)
+                self.hm(v)
+            elif v in MOVES and not self.txt_mode:
+                c = 1
+                while q and q[0] == ('k', v):
+                    self.pop()
+                    c += 1
+                dx, dy = MOVES[v]
+                self.move_cur(dx * c, dy * c)
+                self.sx = None
+                self.sy = None
+            else:
+                self.hk(v)
+        if self.jrn and n:
+            self.jrn.flush()
+        return n
+    def move_cur(self, dx, dy):
+        x = self.cx + dx
+        y = self.cy + dy
+        self.cx = min(max(x, 0), self.cw - 1)
+        self.cy = min(max(y, 0), self.ch - 1)
+        self.view_x += x - self.cx
+        self.view_y += y - self.cy
     def update_fps(self):
-        self.frames += 1
         now = time.time()
         if now - self.last_t >= 1.0:
             self.fps = self.frames
+            out = getattr(self.scr, 'out_bytes', None)
+            if out is not None:
+                self.bpf = (out - self.last_out) // max(1, self.frames)
+                self.last_out = out
             self.frames = 0
             self.last_t = now
-    def render(self):
-        if not self.dirty:
-            return
-        self.scr.clear()
-        for y in range(self.ch):
-            for x in range(self.cw):
-                c = ' '
-                fg_col = 0
-                bg_col = 0
-                for lyr in self.lyrs:
-                    if lyr.vis:
-                        px = lyr.get(x, y)
-                        if px != ' ':
-                            c = px
-                            fg_col = lyr.get_col(x, y)
-                            bg_col = lyr.get_bg(x, y)
-                            if isinstance(fg_col, str):
-                                fg_col = int(fg_col) if fg_col.isdigit() else 0
-                            if isinstance(bg_col, str):
-                                bg_col = int(bg_col) if bg_col.isdigit() else 0
-                if self.grid and (x % 5 == 0 or y % 3 == 0) and c == ' ':
-                    c = '·'
-                try:
-                    fc = len(self.col_names)
-                    bc = len(self.bg_names)
-                    pair_id = 1 + (fg_col * bc) + bg_col
-                    mp = fc * bc
-                    if pair_id < 1 or pair_id > mp:
-                        pair_id = 1
-                    attr = curses.color_pair(pair_id) if c != ' ' or bg_col > 0 else 0
-                    self.scr.addch(y + 1, x, c, attr)
-                except curses.error:
-                    pass
-        try:
-            cur_c = self.gl().get(self.cx, self.cy) if self.gl() else ' '
-            if cur_c == ' ':
-                cur_c = '+'
-            self.scr.addch(self.cy + 1, self.cx, cur_c, curses.A_REVERSE)
-        except curses.error:
-            pass
-        if self.sel:
-            x1, y1, x2, y2 = self.sel
-            for x in range(x1, x2 + 1):
-                try:
-                    self.scr.addch(y1 + 1, x, '-', curses.A_BOLD)
-                    self.scr.addch(y2 + 1, x, '-', curses.A_BOLD)
-                except curses.error:
-                    pass
-            for y in range(y1, y2 + 1):
+            if self.debug_info:
+                self.prof_txt = self.prof.text()
+    def compose_span(self, y, x1, x2):
+        n = x2 - x1 + 1
+        self.comp.put_span(x1, y, array('I', [32]) * n, bytes(n), bytes(n))
+        z = self.zoom
+        a, cy = self.scr_pt(x1, y)
+        b = self.scr_pt(x2, y)[0]
+        idx = None
+        if z != 1.0:
+            idx = [int(x / z) - int(x1 / z) for x in range(x1, x2 + 1)]
+        for lyr in self.lyrs:
+            if not lyr.vis:
+                continue
+            if idx is not None and isinstance(lyr, VLyr):
+                chs, fgs, bgs = lyr.view_span(x1, x2, y, self.view_x, self.view_y, z)
+                if chs.count(32) == len(chs):
+                    continue
+                if lyr.alpha < 1.0:
+                    chs = ENG.dither(chs, x1, y, lyr.alpha)
+                self.comp.put_span(x1, y, chs, fgs, bgs, skip=True)
+                continue
+            chs, fgs, bgs = lyr.get_span(a, b, cy)
+            if chs.count(32) == len(chs):
+                continue
+            if lyr.alpha < 1.0:
+                chs = ENG.dither(chs, a, cy, lyr.alpha)
+            if idx is not None:
+                chs = array('I', [chs[i] for i in idx])
+                fgs = bytes([fgs[i] for i in idx])
+                bgs = bytes([bgs[i] for i in idx])
+            self.comp.put_span(x1, y, chs, fgs, bgs, skip=True)
+    def compose(self):
+        if self.comp.w != self.cw or self.comp.h != self.ch:
+            self.comp = Lyr(self.cw, self.ch, "comp")
+        if not ENG.compose(self):
+            for y in range(self.ch):
+                self.compose_span(y, 0, self.cw - 1)
+        self.recomp = False
+    def scr_range(self, a, b, v):
+        return math.ceil((a - v) * self.zoom), math.ceil((b + 1 - v) * self.zoom) - 1
+    def dmg_spans(self):
+        spans = []
+        vx, vy = self.view_x, self.view_y
+        for y, (x1, x2) in self.dmg.rows.items():
+            sy1, sy2 = self.scr_range(y, y, vy)
+            sx1, sx2 = self.scr_range(x1, x2, vx)
+            sx1, sx2 = max(sx1, 0), min(sx2, self.cw - 1)
+            if sx1 > sx2:
+                continue
+            for sy in range(max(sy1, 0), min(sy2, self.ch - 1) + 1):
+                spans.append((sy, sx1, sx2))
+        return spans
+    def draw_span(self, y, x1, x2):
+        chs, fgs, bgs = self.comp.row(y)
+        bc = len(self.bg_names)
+        pairs = self.pairs
+        mp = len(pairs)
+        cs = list(map(chr, chs[x1:x2 + 1]))
+        if self.grid:
+            for i, c in enumerate(cs):
+                if c == ' ':
+                    gx, gy = self.scr_pt(x1 + i, y)
+                    if gx % 5 == 0 or gy % 3 == 0:
+                        cs[i] = '·'
+        s = x1
+        last = None
+        for x in range(x1, x2 + 2):
+            if x <= x2:
+                bg_col = bgs[x]
+                if bg_col == 0 and cs[x - x1] == ' ':
+                    attr = 0
+                else:
+                    pid = fgs[x] * bc + bg_col
+                    attr = pairs[pid] if pid < mp else pairs[0]
+                if attr == last:
+                    continue
+            if last is not None:
                 try:
-                    self.scr.addch(y + 1, x1, '|', curses.A_BOLD)
-                    self.scr.addch(y + 1, x2, '|', curses.A_BOLD)
+                    self.scr.addstr(y + 1, s, ''.join(cs[s - x1:x - x1]), last)
                 except curses.error:
                     pass
-        if self.sx is not None and self.sy is not None:
-            try:
-                self.scr.addch(self.sy + 1, self.sx, 'X', curses.A_BOLD | curses.A_BLINK)
-            except curses.error:
-                pass
+            if x <= x2:
+                s = x
+                last = attr
+    def status_text(self):
         tool_name = self.tools[self.tool]
         lyr_name = self.get_lyr().nm if self.get_lyr() else "none"
         fg_name = self.col_names[self.col]
         bg_name = self.bg_names[self.bg_col]
         status = f"Tool: {tool_name} | FG: {fg_name} | BG: {bg_name} | Layer: {lyr_name}"
-        status += f" | Pos: {self.cx},{self.cy} | Zoom: {self.zoom:.1f}x"
-        if self.sx is not None and tool_name in ["line", "box", "circ", "arrow", "star", "tri", "hex"]:
+        rx, ry = self.rp()
+        status += f" | Pos: {rx},{ry} | Zoom: {self.zoom:.1f}x"
+        if self.sx is not None and tool_name in SHAPE_TOOLS:
             status += f" | START: {self.sx},{self.sy}"
+        if self.filled and tool_name in SHAPE_TOOLS:
+            status += " | FILLED"
         if self.snap:
             status += " | SNAP"
+        if self.clip:
+            status += f" | Clip: {self.clip.w}x{self.clip.h}"
         if self.thick > 1:
-            status += f" | T:{self.thick}"
+            status += f" | T:{self.thick} {self.cap}"
+        if tool_name == "fill" and self.fill_mode:
+            status += f" | Fill: {FILL_MODES[self.fill_mode][0]}"
         if self.debug_info:
             uptime = int(time.time() - self.stats['start_time'])
-            status += f" | FPS: {self.fps} | Time: {uptime}s"
+            status += f" | FPS: {self.fps} | Time: {uptime}s | Idle: {self.stats['idle_wakeups']}/{self.stats['wakeups']}"
+            if self.bpf is not None:
+                status += f" | Out: {self.bpf}B/f"
+        sv = self.autosave.status()
+        if sv:
+            status += f" | {sv}"
+        return status
+    def bottom_text(self):
+        if self.txt_mode:
+            return f"TEXT: {self.txt_buf}_"
+        if self.msg:
+            return self.msg
+        return f"TAB: Tools | K: Colors | N: Shapes | P: Patterns | F: Snap | =/-: Zoom | H: Help | Q: Quit"
+    def draw_ovl(self, x, y, c, attr):
+        if not (0 <= x < self.cw and 0 <= y < self.ch):
+            return
+        self.ovl_cells.append((x, y))
         try:
-            self.scr.addstr(0, 0, status[:self.w-1])
+            self.scr.addch(y + 1, x, c, attr)
         except curses.error:
             pass
-        if self.txt_mode:
-            txt_status = f"TEXT: {self.txt_buf}_"
+    def ovl_key(self):
+        return (self.cx, self.cy, self.sel, self.sx, self.sy, self.prof_txt if self.debug_info else None)
+    def stale(self):
+        if self.dirty or self.recomp or self.dmg or self.inq:
+            return True
+        if (self.view_x, self.view_y, self.zoom) != self.last_view or self.ovl_key() != self.last_ovl:
+            return True
+        return self.status_text() != self.last_st or self.bottom_text() != self.last_bt
+    def frame_wait(self):
+        now = time.perf_counter()
+        if self.stale():
+            return max(0, int((self.next_frame - now) * 1000))
+        waits = []
+        a = self.autosave.wait()
+        if a is not None:
+            waits.append(a)
+        if self.debug_info:
+            waits.append(max(0.0, self.last_t + 1.0 - time.time()))
+        if not waits:
+            return None
+        return max(1, int(min(waits) * 1000) + 1)
+    def render(self):
+        status = self.status_text()
+        bottom = self.bottom_text()
+        ovl = self.ovl_key()
+        view = (self.view_x, self.view_y, self.zoom)
+        if view != self.last_view:
+            self.last_view = view
+            self.recomp = True
+        if not self.dirty and not self.recomp and not self.dmg and ovl == self.last_ovl and status == self.last_st and bottom == self.last_bt:
+            return
+        spans = self.dmg_spans()
+        self.dmg.clear()
+        t = time.perf_counter()
+        if self.recomp:
+            self.compose()
+            self.dirty = True
+        else:
+            for y, x1, x2 in spans:
+                self.compose_span(y, x1, x2)
+        t = self.prof.add("compose", t)
+        if self.dirty:
+            self.scr.erase()
+            for y in range(self.ch):
+                self.draw_span(y, 0, self.cw - 1)
+            self.last_st = None
+            self.last_bt = None
+        else:
+            for x, y in self.ovl_cells:
+                self.draw_span(y, x, x)
+            for y, x1, x2 in spans:
+                self.draw_span(y, x1, x2)
+        self.ovl_cells = []
+        cur_c = self.gl().get(*self.rp()) if self.gl() else ' '
+        if cur_c == ' ':
+            cur_c = '+'
+        self.draw_ovl(self.cx, self.cy, cur_c, curses.A_REVERSE)
+        if self.sel:
+            x1, y1 = self.zoom_pt(self.sel[0], self.sel[1])
+            x2, y2 = self.zoom_pt(self.sel[2], self.sel[3])
+            x1, y1 = max(x1, -1), max(y1, -1)
+            x2, y2 = min(x2, self.cw), min(y2, self.ch)
+            for x in range(x1, x2 + 1):
+                self.draw_ovl(x, y1, '-', curses.A_BOLD)
+                self.draw_ovl(x, y2, '-', curses.A_BOLD)
+            for y in range(y1, y2 + 1):
+                self.draw_ovl(x1, y, '|', curses.A_BOLD)
+                self.draw_ovl(x2, y, '|', curses.A_BOLD)
+        if self.sx is not None and self.sy is not None:
+            sx, sy = self.zoom_pt(self.sx, self.sy)
+            self.draw_ovl(sx, sy, 'X', curses.A_BOLD | curses.A_BLINK)
+        if self.debug_info:
+            x0 = self.cw - max((len(ln) for ln in self.prof_txt), default=0)
+            for y, ln in enumerate(self.prof_txt):
+                for i, c in enumerate(ln):
+                    self.draw_ovl(x0 + i, y, c, curses.A_REVERSE)
+        self.last_ovl = ovl
+        if status != self.last_st:
             try:
-                self.scr.addstr(self.h - 1, 0, txt_status[:self.w-1])
+                self.scr.addstr(0, 0, status[:self.w-1].ljust(self.w-1))
             except curses.error:
                 pass
-        else:
-            bottom = f"TAB: Tools | K: Colors | N: Shapes | P: Patterns | F: Snap | =/-: Zoom | H: Help | Q: Quit"
+            self.last_st = status
+        if bottom != self.last_bt:
             try:
-                self.scr.addstr(self.h - 1, 0, bottom[:self.w-1])
+                self.scr.addstr(self.h - 1, 0, bottom[:self.w-1].ljust(self.w-1))
             except curses.error:
                 pass
+            self.last_bt = bottom
+        t = self.prof.add("draw", t)
         self.scr.refresh()
+        self.prof.add("refresh", t)
         self.dirty = False
     def run(self):
         while self.running:
             self.uf()
-            if self.help:
-                self.show_help()
-                self.help = False
-                continue
-            self.render()
-            while True:
-                try:
-                    k = self.scr.getch()
-                    if k == -1 or k == curses.ERR:
-                        break
-                    if k == curses.KEY_MOUSE:
-                        self.hm(k)
-                    else:
-                        self.hk(k)
-                except curses.error:
-                    break
+            if self.autosave.due():
+                self.save_bg(self.autosave.fname)
+            now = time.perf_counter()
+            if now >= self.next_frame:
+                self.render()
+                self.prof.frame()
+                self.frames += 1
+                if MAX_FPS > 0:
+                    self.next_frame = now + 1.0 / MAX_FPS
+            blocked, got = self.read_input(self.frame_wait())
+            if blocked:
+                self.stats['wakeups'] += 1
+                if not got:
+                    self.stats['idle_wakeups'] += 1
+            t = time.perf_counter()
+            sub = self.prof.cur["tool"] + self.prof.cur["save"]
+            if self.pump():
+                self.prof.add("dispatch", t, self.prof.cur["tool"] + self.prof.cur["save"] - sub)
+        self.render()
     def handle_keyboard(self, k):
+        self.msg = ""
         if DEBUG and k != -1:
             try:
                 self.scr.addstr(self.h - 2, 0, f"Key: {k} ({chr(k) if 32 <= k <= 126 else 'special'})", curses.A_DIM)
@@ -1297,29 +3610,13 @@ class App:
                     self.txt_buf = self.txt_buf[:-1]
             elif 32 <= k <= 126:  
                     self.txt_buf += chr(k)
-            self.dirty = True
             return
         if k == ord('q'):
             self.running = False
-        elif k == curses.KEY_UP or k == ord('w'):
-            if self.cy > 0:
-                self.cy = self.cy - 1
-            self.dirty = True
-        elif k == curses.KEY_DOWN or k == ord('s'):
-            if self.cy < self.ch - 1:
-                self.cy = self.cy + 1
-            self.dirty = True
-        elif k == curses.KEY_LEFT or k == ord('a'):
-            if self.cx > 0:
-                self.cx = self.cx - 1
-            self.dirty = True
-        elif k == curses.KEY_RIGHT or k == ord('d'):
-            if self.cx < self.cw - 1:
-                self.cx = self.cx + 1
-            self.dirty = True
+        elif k in MOVES:
+            self.move_cur(*MOVES[k])
         elif k == ord(' ') or k == 32:  
             self.ht()
-            self.dirty = True
         elif k == ord('\t'):
             self.mt()
         elif k == ord('b'):
@@ -1335,41 +3632,33 @@ class App:
         elif k == ord('['):
             if self.thick > 1:
                 self.thick = self.thick - 1
-            self.dirty = True
         elif k == ord(']'):
             if self.thick < 5:
                 self.thick = self.thick + 1
-            self.dirty = True
+        elif k == ord('\\'):
+            self.cap = "round" if self.cap == "square" else "square"
         elif k == ord('='):
             self.zoom = self.zoom * 1.2
             if self.zoom > 3.0:
                 self.zoom = 3.0
-            self.dirty = True
         elif k == ord('_'):
             self.zoom = self.zoom / 1.2  
             if self.zoom < 0.5:
                 self.zoom = 0.5
-            self.dirty = True
         elif k == ord('0'):
             self.zoom = 1.0
             self.view_x = 0
             self.view_y = 0
-            self.dirty = True
         elif k == ord('f'):
             self.snap = not self.snap
-            self.dirty = True
         elif k == curses.KEY_SR:  
             self.view_y = self.view_y - 2
-            self.dirty = True
         elif k == curses.KEY_SF:  
             self.view_y = self.view_y + 2
-            self.dirty = True
         elif k == curses.KEY_SLEFT:  
             self.view_x = self.view_x - 2
-            self.dirty = True
         elif k == curses.KEY_SRIGHT:  
             self.view_x = self.view_x + 2
-            self.dirty = True
         elif ord('1') <= k <= ord('5'):
             n = k - ord('0')  
             self.size = n
@@ -1378,17 +3667,14 @@ class App:
                 brush = self.brs[self.br]
                 self.char = brush.c
                 self.col = brush.fg
-            self.dirty = True
         elif k == ord('c'):
             self.col = self.col + 1
             if self.col >= len(self.col_names):
                 self.col = 0
-            self.dirty = True
         elif k == ord('v'):
             self.bg_col = self.bg_col + 1
             if self.bg_col >= len(self.bg_names):
                 self.bg_col = 0
-            self.dirty = True
         elif k == ord('u'):
             self.undo()
         elif k == ord('r'):
@@ -1396,6 +3682,8 @@ class App:
         elif k == ord('x'):
             self.clr_canvas()
             self.dirty = True
+        elif k == ord('T'):
+            self.tile_pat()
         elif k == ord('X'):  
             self.clr_canvas()
             self.dirty = True
@@ -1405,13 +3693,23 @@ class App:
         elif k == ord('y'):
             if self.sel:
                 self.copy_sel()
+        elif k == ord('Y'):
+            if self.sel:
+                self.copy_sel(True)
+        elif k == ord('Z'):
+            if self.sel:
+                self.copy_sel(cut=True)
+                self.save_state()
+        elif k in (ord('|'), ord('^'), ord('@'), ord('{'), ord('}')):
+            self.xform_clip(k)
         elif k == ord('o'):  
-            fname = "drawing.json"
-            if os.path.exists(fname):
-                self.load_file(fname)
-                self.dirty = True
+            for fname in ("drawing.dtb", "drawing.json"):
+                if os.path.exists(fname):
+                    self.load_file(fname)
+                    self.dirty = True
+                    break
         elif k == ord('S'):  
-            self.save_file("drawing.json")
+            self.save_bg("drawing.dtb")
         elif k == ord('+'):
             self.add_lyr()
             self.dirty = True
@@ -1420,26 +3718,26 @@ class App:
             self.dirty = True
         elif k == ord('~'):
             self.debug_info = not self.debug_info
-            self.dirty = True
+            self.prof.rec = self.debug_info
+            self.prof_txt = self.prof.text()
+        elif k == ord('E'):
+            self.prof.dump("drawing.trace.json")
         elif k == ord('`'):
             self.exp = not self.exp
-            self.dirty = True
         elif k == ord('D'):  
             toggle_debug()
-            self.dirty = True
         elif k == ord('h'):
-            self.help = True
+            self.show_help()
         elif ord('6') <= k <= ord('9'):
             idx = k - ord('6') + 6  
             if idx < len(self.tools):
                 self.tool = idx
-                self.dirty = True
+        elif k == ord('m'):
+            self.fill_mode = (self.fill_mode + 1) % len(FILL_MODES)
         elif k == ord(','):
             self.pat = (self.pat - 1) % len(self.pats)
-            self.dirty = True
         elif k == ord('.'):
             self.pat = (self.pat + 1) % len(self.pats)
-            self.dirty = True
         if k in [curses.KEY_UP, curses.KEY_DOWN, curses.KEY_LEFT, curses.KEY_RIGHT, 
                  ord('w'), ord('a'), ord('s'), ord('d')]:
             self.sx = None
@@ -1453,7 +3751,21 @@ def main(scr):
         scr.addstr(1, 0, "Press any key to continue anyway...")
         scr.refresh()
         scr.getch()
-    app = App(scr)
-    app.run()
+    app = App(scr, journal=JOURNAL)
+    try:
+        app.run()
+    finally:
+        app.autosave.stop()
+        if app.jrn:
+            app.jrn.close()
 if __name__ == "__main__":
-    curses.wrapper(main)
+    if len(sys.argv) == 4 and sys.argv[1] == '--convert':
+        convert(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 2 and sys.argv[1] == '--ansi':
+        ansi_main()
+    elif len(sys.argv) in (3, 4, 5) and sys.argv[1] == '--replay':
+        app, res = replay(sys.argv[2], int(sys.argv[3]) if len(sys.argv) >= 4 else -1, sys.argv[4] if len(sys.argv) == 5 else None)
+        print(app.scr.text())
+        print(json.dumps(res))
+    else:
+        curses.wrapper(main)